@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+
+## enumerates the combinations of a synthetic recipe (1,000,000 combinations by default),
+## as lightweight combinations (RecipeFile.combinations) and as SubstitutionFile objects,
+## and compares SubstitutionFile creation against the old deepcopy merge of per-block SubstitutionFiles
+
+import os
+import time
+import resource
+import argparse
+import tempfile
+
+dir_slimerge = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
+
+import sys
+sys.path.append(dir_slimerge_src)
+
+from recipe_file import RecipeFile, make_substitution_file, product_cached
+from substitution_file import SubstitutionFile
+
+parser = argparse.ArgumentParser(description="benchmark enumeration of recipe combinations")
+parser.add_argument("--values", type=int, default=10,
+                    help="number of values per variable (default: 10)")
+parser.add_argument("--variables", type=int, default=2,
+                    help="number of variables per block (default: 2)")
+parser.add_argument("--blocks", type=int, default=3,
+                    help="number of blocks (default: 3; i.e. 10^(2*3) = 1,000,000 combinations)")
+parser.add_argument("-n", "--materialise", type=int, default=100000, dest="materialise",
+                    help="number of combinations to create SubstitutionFile objects for (default: 100000)")
+args = parser.parse_args()
+
+## synthetic recipe: one block per module, each with 'variables' variables with 'values' values
+def synthetic_recipe(num_blocks, num_variables, num_values):
+    blocks = []
+    for b in range(num_blocks):
+        lines = [f"[module_{b}.slim]"]
+        for v in range(num_variables):
+            lines.append(f"VAR_{b}_{v}=" + ';'.join([str(i) for i in range(num_values)]))
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks) + '\n'
+
+## the old RecipeBlockMulti.substitution_combos (one SubstitutionFile per block per combination,
+## deep-copied into the combination's SubstitutionFile)
+def old_substitution_combos(recipe_file):
+    block_combos = [(make_substitution_file(combo, i+1) for i, combo in enumerate(block.combinations()))
+                    for block in recipe_file.recipe.blocks]
+    for i, combo in enumerate(product_cached(*block_combos)):
+        output = SubstitutionFile(suppress_warning = True)
+        for sub_file in combo:
+            output.merge(sub_file, overwrite = True, deepcopy = True)
+        output.substitution_id = i+1
+        yield output
+    return
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench(label, iterable, limit = None):
+    start = time.perf_counter()
+    n = 0
+    for e in iterable:
+        n += 1
+        if limit is not None and n >= limit: break
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40}{n:>10} in {elapsed:>7.2f} s{n / elapsed:>12.0f} /s"
+          f"    max RSS {max_rss_mb():>7.1f} MB")
+    return
+
+with tempfile.TemporaryDirectory() as dir_tmp:
+    f_recipe = os.path.join(dir_tmp, "synthetic.slim.recipe")
+    with open(f_recipe, "w+") as f:
+        f.write(synthetic_recipe(args.blocks, args.variables, args.values))
+    recipe_file = RecipeFile(fname = f_recipe)
+
+print(f"combinations: {recipe_file.num_combos()}")
+print(f"max RSS after parsing recipe: {max_rss_mb():.1f} MB")
+bench("combinations (all)", recipe_file.combinations())
+bench("SubstitutionFile objects", recipe_file.substitution_files(), args.materialise)
+bench("SubstitutionFile objects (deepcopy)", old_substitution_combos(recipe_file), args.materialise)
+
+## check that both produce identical substitution files
+new = [sub_file.generate_string() for sub_file, i in zip(recipe_file.substitution_files(), range(1000))]
+old = [sub_file.generate_string() for sub_file, i in zip(old_substitution_combos(recipe_file), range(1000))]
+print("identical output (first 1000):", new == old)
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+## times each stage of the recipe -> script pipeline separately on a synthetic recipe and modules
+## of configurable size (or on an existing recipe with --recipe):
+## parsing the recipe (RecipeFile), enumerating combinations (RecipeFile.combinations),
+## creating SubstitutionFile objects (RecipeFile.substitution_files), SubstitutionFile.build_script
+## and Script.make_string, and reports throughput and peak memory of each stage.
+## (see check_golden_outputs.py to check that scripts are unchanged)
+
+import os
+import time
+import resource
+import argparse
+import tempfile
+import tracemalloc
+
+dir_slimerge = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
+
+import sys
+sys.path.append(dir_slimerge_src)
+
+from recipe_file import RecipeFile
+from code_blocks import module_cache
+
+parser = argparse.ArgumentParser(description="benchmark each stage of the recipe -> script pipeline")
+parser.add_argument("--recipe", type=os.path.abspath, default=None,
+                    help="path to .slim.recipe file to benchmark instead of a synthetic recipe")
+parser.add_argument("--module-path", help="path to directory containing .slim module files (with --recipe)",
+                    action="append", dest="module_paths", type=os.path.abspath, default=[])
+parser.add_argument("--modules", type=int, default=5,
+                    help="number of synthetic modules (default: 5)")
+parser.add_argument("--variables", type=int, default=3,
+                    help="number of variables per module (default: 3)")
+parser.add_argument("--values", type=int, default=3,
+                    help="number of values of the first variable of each module (default: 3)")
+parser.add_argument("--lines", type=int, default=50,
+                    help="number of lines per module (default: 50)")
+parser.add_argument("--alternatives", type=int, default=2,
+                    help="number of alternatives per alternative block (default: 2)")
+parser.add_argument("--depth", type=int, default=2,
+                    help="nesting depth of alternative blocks (default: 2; 0 for no alternative blocks)")
+parser.add_argument("-n", "--combos", type=int, default=2000, dest="combos",
+                    help="number of combinations to enumerate and build (default: 2000)")
+parser.add_argument("--tracemalloc", action="store_true", dest="tracemalloc",
+                    help="also report peak Python memory allocated by each stage (slower)")
+parser.add_argument("--keep", type=os.path.abspath, default=None, metavar="DIRECTORY",
+                    help="write synthetic recipe and modules to this directory instead of a temporary one")
+args = parser.parse_args()
+
+## synthetic module: an initialize() callback defining all of the module's variables as constants,
+## and a late() callback padded to 'num_lines' lines in total
+def synthetic_module(m, num_variables, num_lines):
+    variables = [f"VAR_{m}_{v}" for v in range(num_variables)]
+    lines = [f"// variables with defaults: {','.join(variables)}",
+             "initialize() {"]
+    lines.extend([f"\tdefineConstant(\"{variable}\", ${variable}$);" for variable in variables])
+    lines.extend(["}", "", f"$START_{m}$:$END_{m}$ late() {{"])
+    for i in range(max(num_lines - len(lines) - 1, 1)):
+        if i % 4 == 0:
+            lines.append(f"\tif (sim.cycle % {i + 2} == 0) {{ x_{m}_{i} = {variables[i % num_variables]} * {i}; }}")
+        else:
+            lines.append(f"\tdefineGlobal(\"Y_{m}_{i}\", {variables[i % num_variables]} + {i});")
+    lines.append("}")
+    return '\n'.join(lines) + '\n'
+
+## recipe block for module m (the first variable has 'num_values' values)
+def synthetic_block(m, num_variables, num_values, indentation = '', order = None, offset = 0):
+    header = f"[module_{m}.slim]" + ('' if order is None else f".{order}")
+    lines = [header, f"START_{m}=1", f"END_{m}=100"]
+    lines.append(f"VAR_{m}_0=" + ';'.join([str(offset + i) for i in range(num_values)]))
+    lines.extend([f"VAR_{m}_{v}={v}" for v in range(1, num_variables)])
+    return '\n'.join([indentation + line for line in lines])
+
+## alternative block with 'num_alternatives' alternatives, each with its own values for the
+## last module (and, if depth > 1, a nested alternative block)
+def synthetic_alt_block(m, num_variables, num_values, num_alternatives, depth, indentation = ''):
+    alternatives = []
+    for a in range(num_alternatives):
+        lines = [synthetic_block(m, num_variables, num_values, indentation + "  ",
+                                 order = depth, offset = a * num_values)]
+        if depth > 1:
+            lines.append(synthetic_alt_block(m, num_variables, num_values, num_alternatives, depth - 1,
+                                             indentation + "  "))
+        alternatives.append('\n\n'.join(lines))
+    return (indentation + '{\n' + f"\n{indentation}}}|{{\n".join(alternatives) + '\n' + indentation + '}')
+
+def synthetic_recipe(num_modules, num_variables, num_values, num_alternatives, depth):
+    blocks = ["[]\nGENERAL_VARIABLE=1"]
+    blocks.extend([synthetic_block(m, num_variables, num_values)
+                   for m in range(num_modules - (1 if depth > 0 else 0))])
+    if depth > 0:
+        blocks.append(synthetic_alt_block(num_modules - 1, num_variables, num_values, num_alternatives, depth))
+    return '\n\n'.join(blocks) + '\n'
+
+def write_synthetic(dir_out):
+    for m in range(args.modules):
+        with open(os.path.join(dir_out, f"module_{m}.slim"), "w+") as f:
+            f.write(synthetic_module(m, args.variables, args.lines))
+    f_recipe = os.path.join(dir_out, "synthetic.slim.recipe")
+    with open(f_recipe, "w+") as f:
+        f.write(synthetic_recipe(args.modules, args.variables, args.values, args.alternatives, args.depth))
+    return f_recipe
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+## time function(); returns its output and prints number of items (len(output)) per second
+def bench(label, unit, function):
+    if args.tracemalloc:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = function()
+    elapsed = time.perf_counter() - start
+    n = len(output) if isinstance(output, list) else 1
+    peak = ''
+    if args.tracemalloc:
+        peak = f"    peak alloc {tracemalloc.get_traced_memory()[1] / 1024 / 1024:>7.1f} MB"
+        tracemalloc.stop()
+    print(f"{label:<32}{n:>8} in {elapsed:>8.3f} s{n / elapsed:>12.0f} {unit}/s"
+          f"    max RSS {max_rss_mb():>7.1f} MB{peak}")
+    return output
+
+def take(iterable, n):
+    return [e for e, i in zip(iterable, range(n))]
+
+def run(f_recipe, module_paths):
+    recipe_file = bench("parse recipe", "recipes", lambda: RecipeFile(fname = f_recipe, module_paths = module_paths))
+    print(f"{'':<32}{recipe_file.num_combos():>8} combinations in recipe")
+    bench("enumerate combinations", "combos", lambda: take(recipe_file.combinations(), args.combos))
+    sub_files = bench("substitution files", "files", lambda: take(recipe_file.substitution_files(), args.combos))
+    bench("generate substitution strings", "files", lambda: [sub_file.generate_string() for sub_file in sub_files])
+    ## (first build parses module files; see module cache counts)
+    scripts = bench("build_script", "scripts", lambda: [sub_file.build_script() for sub_file in sub_files])
+    strings = bench("make_string", "scripts", lambda: [script.make_string() for script in scripts])
+    print(f"{'':<32}mean script length {sum(len(s) for s in strings) / max(len(strings), 1):.0f} characters;"
+          f" module cache {module_cache.hits} hits, {module_cache.misses} misses")
+    return
+
+if args.recipe is not None:
+    module_paths = args.module_paths + [os.path.join(dir_slimerge, "test", "modules")]
+    print(f"recipe: {args.recipe}")
+    run(args.recipe, module_paths)
+elif args.keep is not None:
+    os.makedirs(args.keep, exist_ok = True)
+    print(f"synthetic recipe: {args.keep}")
+    run(write_synthetic(args.keep), [args.keep])
+else:
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        print(f"synthetic recipe: {args.modules} modules x {args.variables} variables x {args.lines} lines,"
+              f" {args.values} values, {args.alternatives} alternatives, depth {args.depth}")
+        run(write_synthetic(dir_tmp), [dir_tmp])
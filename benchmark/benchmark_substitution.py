@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+## compares SubstitutionBlockGen.substitute's single-pass compiled templates
+## against the old loop of str.replace (one pass over the script per variable)
+
+import os
+import time
+import argparse
+
+dir_slimerge = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+default_module_paths = [os.path.join(dir_slimerge, "test", "modules")]
+default_recipe = os.path.join(dir_slimerge, "test", "recipes", "scd.slim.recipe")
+dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
+
+import sys
+sys.path.append(dir_slimerge_src)
+
+from recipe_file import RecipeFile
+from code_blocks import module_cache
+from substitution_file import SubstitutionTemplate, compile_template, resolve_in_order
+
+parser = argparse.ArgumentParser(description="benchmark placeholder substitution on multi-module scripts")
+parser.add_argument("--recipe", type=os.path.abspath, default=default_recipe,
+                    help="path to .slim.recipe file (default: test/recipes/scd.slim.recipe)")
+parser.add_argument("--module-path", help="path to directory containing .slim module files",
+                    action="append", dest="module_paths", type=os.path.abspath, default=[])
+parser.add_argument("-n", "--combos", type=int, default=200, dest="combos",
+                    help="number of combinations to benchmark")
+args = parser.parse_args()
+
+module_paths = args.module_paths + [path for path in default_module_paths if path not in args.module_paths]
+
+## the old SubstitutionBlockGen.substitute
+def substitute_loop(string, variables):
+    for varname, val in variables.items():
+        string = string.replace(f"${varname}$", val)
+    return string
+
+def substitute_compiled(string, variables):
+    return compile_template(string).fill(resolve_in_order(variables))
+
+## one (unsubstituted multi-module script, variables) pair per combination,
+## where the script is all of the combination's modules concatenated and
+## variables is the union of all of the combination's substitution blocks
+recipe_file = RecipeFile(fname = args.recipe, module_paths = module_paths)
+jobs = []
+for sub_file in recipe_file.substitution_files():
+    if len(jobs) >= args.combos: break
+    strings = []
+    variables = {}
+    for sub_block in sub_file.blocks():
+        variables = {**variables, **sub_block.variables}
+        module_path = sub_file.get_module_path(sub_block.filename)
+        if not module_path: continue
+        strings.append(module_cache.get(module_path).make_string(substitute = False))
+    jobs.append((''.join(strings), variables))
+
+print(f"recipe: {args.recipe}")
+print(f"combinations: {len(jobs)}")
+print(f"mean script length: {sum(len(s) for s, v in jobs) / max(len(jobs), 1):.0f} characters")
+print(f"mean variables per combination: {sum(len(v) for s, v in jobs) / max(len(jobs), 1):.1f}")
+
+def bench(label, function, inputs):
+    start = time.perf_counter()
+    outputs = [function(string, variables) for string, variables in inputs]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<30}{elapsed * 1000:>10.1f} ms{len(inputs) / elapsed:>14.0f} strings/s")
+    return outputs
+
+## whole-script substitution (ScriptModule.make_string + substitute)
+print("\nwhole script")
+expected = bench("str.replace loop", substitute_loop, jobs)
+compile_template.cache_clear()
+bench("compiled (cold cache)", lambda s, v: SubstitutionTemplate(s).fill(resolve_in_order(v)), jobs)
+observed = bench("compiled (template cache)", substitute_compiled, jobs)
+print("identical output:", expected == observed)
+
+## line-by-line substitution (ScriptModule.copy / CodeBlock.substituted)
+line_jobs = [(line, variables) for string, variables in jobs for line in string.splitlines()]
+print(f"\nline by line ({len(line_jobs)} lines)")
+expected = bench("str.replace loop", substitute_loop, line_jobs)
+compile_template.cache_clear()
+observed = bench("compiled (template cache)", substitute_compiled, line_jobs)
+print("identical output:", expected == observed)
+print(compile_template.cache_info())
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+
+## checks that substitution files and scripts built from the recipes in test/recipes (with the
+## modules in test/modules) are byte-identical to those recorded in golden_outputs.tsv
+## (SHA-256 of SubstitutionFile.generate_string and SubstitutionFile.build_script().make_string
+## for evenly spaced substitution IDs of each recipe). Use --write to record new golden outputs.
+
+import os
+import glob
+import time
+import hashlib
+import argparse
+
+dir_slimerge = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
+default_module_paths = [os.path.join(dir_slimerge, "test", "modules")]
+default_recipe_files = sorted(glob.glob(os.path.join(dir_slimerge, "test", "recipes", "*.recipe")))
+default_golden = os.path.join(os.path.dirname(os.path.realpath(__file__)), "golden_outputs.tsv")
+
+import sys
+sys.path.append(dir_slimerge_src)
+
+from recipe_file import RecipeFile
+
+parser = argparse.ArgumentParser(description="check built scripts against golden outputs")
+parser.add_argument("--recipe", help="path to recipe file (default: all in test/recipes)",
+                    action="append", dest="recipe_files", type=os.path.abspath, default=[])
+parser.add_argument("--golden", type=os.path.abspath, default=default_golden,
+                    help="path to golden outputs file (default: benchmark/golden_outputs.tsv)")
+parser.add_argument("--write", action="store_true", dest="write",
+                    help="record golden outputs (overwrites --golden) instead of checking them")
+parser.add_argument("--sample", type=int, default=200,
+                    help="number of substitution IDs per recipe to record with --write (default: 200)")
+parser.add_argument("--stream", action="store_true", dest="stream",
+                    help=("generate substitution files by enumerating all combinations (RecipeFile.substitution_files())"
+                          " instead of by substitution ID"))
+args = parser.parse_args()
+
+columns = ["RECIPE", "SUBSTITUTION_ID", "SUBSTITUTION_SHA256", "SCRIPT_SHA256"]
+
+def sha256(string):
+    return hashlib.sha256(string.encode()).hexdigest()
+
+## evenly spaced substitution IDs (including the first and last)
+def sample_ids(num_combos, num_samples):
+    if num_combos <= num_samples:
+        return list(range(1, num_combos + 1))
+    return sorted(set([1 + (i * (num_combos - 1)) // (num_samples - 1) for i in range(num_samples)]))
+
+## {substitution ID: (substitution file hash, script hash)}
+def hash_outputs(recipe_file, substitution_ids):
+    if args.stream:
+        wanted = set(substitution_ids)
+        sub_files = (sub_file for sub_file in recipe_file.substitution_files() if sub_file.substitution_id in wanted)
+    else:
+        sub_files = recipe_file.substitution_files(substitution_ids = substitution_ids)
+    return {sub_file.substitution_id: (sha256(sub_file.generate_string()),
+                                       sha256(sub_file.build_script().make_string()))
+            for sub_file in sub_files}
+
+## {recipe basename: {substitution ID: (substitution file hash, script hash)}}
+def read_golden(fname):
+    golden = {}
+    with open(fname, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if row[0] == columns[0]: continue
+            golden.setdefault(row[0], {})[int(row[1])] = (row[2], row[3])
+    return golden
+
+recipe_files = args.recipe_files or default_recipe_files
+
+if args.write:
+    with open(args.golden, "w+") as f:
+        f.write('\t'.join(columns) + '\n')
+        for f_recipe in recipe_files:
+            recipe_file = RecipeFile(fname = f_recipe, module_paths = default_module_paths)
+            outputs = hash_outputs(recipe_file, sample_ids(recipe_file.num_combos(), args.sample))
+            for sub_id, hashes in sorted(outputs.items()):
+                f.write('\t'.join([os.path.basename(f_recipe), str(sub_id), *hashes]) + '\n')
+            print(f"{os.path.basename(f_recipe)}: recorded {len(outputs)} combinations")
+    sys.exit(0)
+
+golden = read_golden(args.golden)
+mismatches = 0
+for f_recipe in recipe_files:
+    name = os.path.basename(f_recipe)
+    if name not in golden:
+        print(f"{name}: no golden outputs (skipped)")
+        continue
+    start = time.perf_counter()
+    recipe_file = RecipeFile(fname = f_recipe, module_paths = default_module_paths)
+    expected = golden[name]
+    observed = hash_outputs(recipe_file, sorted(expected))
+    for sub_id, hashes in sorted(expected.items()):
+        if observed.get(sub_id) != hashes:
+            mismatches += 1
+            differs = "missing" if sub_id not in observed else \
+                ' and '.join([label for label, e, o in zip(["substitution file", "script"], hashes, observed[sub_id])
+                              if e != o])
+            print(f"MISMATCH: {name} substitution ID {sub_id} ({differs})")
+    print(f"{name}: {len(expected)} combinations checked in {time.perf_counter() - start:.2f} s")
+print("identical output:", mismatches == 0)
+sys.exit(1 if mismatches else 0)
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+## checks that the native brace scanner (scan_nested) produces the same nested lists as
+## the pyparsing grammars in Script and RecipeFile (requires pyparsing)
+
+import os
+import glob
+import time
+import argparse
+
+dir_slimerge = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
+default_module_files = sorted(glob.glob(os.path.join(dir_slimerge, "test", "modules", "*.slim")))
+default_recipe_files = sorted(glob.glob(os.path.join(dir_slimerge, "test", "recipes", "*.recipe")))
+
+import sys
+sys.path.append(dir_slimerge_src)
+
+from code_blocks import Script, scan_nested, unlevel_list
+from recipe_file import RecipeFile
+
+parser = argparse.ArgumentParser(description="check native parser against pyparsing parser")
+parser.add_argument("--module", help="path to .slim module file (default: all in test/modules)",
+                    action="append", dest="module_files", type=os.path.abspath, default=[])
+parser.add_argument("--recipe", help="path to recipe file (default: all in test/recipes)",
+                    action="append", dest="recipe_files", type=os.path.abspath, default=[])
+args = parser.parse_args()
+
+## edge cases: quoted strings after braces, blank blocks, whitespace, windows line endings
+edge_cases = ['', '{}', 'a;\n', 'a {\n}\n', 'f() {"{x" + y;\n "}";\n}\n', "g() { 'a' 'b' c;}",
+              ' a  \r\n b() {\r\n\tc;\r\n}\r\n', 'a {\n b {\n  c {\n   d;\n  }\n }\n}\n',
+              '{\n[general.slim]\n}|{\n[other.slim]\n}', '} | {', '"a""b"', '"a"" {x}']
+
+def check(label, strings, re_token, pyparsing_search):
+    mismatches = 0
+    time_native = 0
+    time_pyparsing = 0
+    for name, string in strings:
+        start = time.perf_counter()
+        try: native = unlevel_list(scan_nested(string, re_token))
+        except Exception as e: native = e.__class__.__name__
+        time_native += time.perf_counter() - start
+        start = time.perf_counter()
+        expected = unlevel_list(pyparsing_search(string))
+        time_pyparsing += time.perf_counter() - start
+        ## unbalanced strings fall back to pyparsing in Script/RecipeFile
+        if native != expected and native != "Exception":
+            mismatches += 1
+            print(f"MISMATCH ({label}): {name}")
+    print(f"{label}: {len(strings)} strings, {mismatches} mismatches;"
+          f" native {time_native * 1000:.1f} ms, pyparsing {time_pyparsing * 1000:.1f} ms")
+    return mismatches
+
+def read(fname):
+    with open(fname, 'r') as f:
+        return f.read()
+
+module_files = args.module_files or default_module_files
+recipe_files = args.recipe_files or default_recipe_files
+mismatches = check("modules", [(fname, read(fname)) for fname in module_files] +
+                   [(repr(s), s) for s in edge_cases], Script.line, Script.pyparsing_search)
+mismatches += check("recipes", [(fname, read(fname)) for fname in recipe_files] +
+                    [(repr(s), s) for s in edge_cases], RecipeFile.lines, RecipeFile.pyparsing_search)
+sys.exit(1 if mismatches else 0)
@@ -1,15 +1,18 @@
 #!/usr/bin/python3
 
+import time
+## time taken by each stage of startup (printed with --profile-startup)
+startup_times = {}
+startup_start = time.perf_counter()
+
+import hashlib
 import itertools
 import os
-import pathlib
-import shutil
-import subprocess
-import time
 import argparse
-import tqdm
 
 from datetime import datetime
+## (shutil, subprocess, tqdm, multiprocess, tempfile, resource, output_store (sqlite3) and
+##  result_cache (json, shutil) are only imported when needed)
 # from threading import Thread
 
 dir_slimerge = os.path.dirname(os.path.realpath(__file__))
@@ -20,7 +23,12 @@ dir_slimerge_src = os.path.join(dir_slimerge, "slimerge")
 import sys
 sys.path.append(dir_slimerge_src)
 
-from recipe_file import RecipeFile
+startup_times["import standard library"] = time.perf_counter() - startup_start
+from recipe_file import RecipeFile, RecipeBlockAlt
+from code_blocks import module_cache
+from substitution_file import substitute_string
+from run_tracker import RunTracker, manifest_columns, dedup_columns, read_manifest, read_dedup, append_manifest
+startup_times["import slimerge"] = time.perf_counter() - startup_start - sum(startup_times.values())
 
 parser = argparse.ArgumentParser(description="generate all SLiM files from recipe file and execute")
 parser.add_argument("recipe", type=os.path.abspath, help="path to .slim.recipe file")
@@ -32,8 +40,8 @@ parser.add_argument("--dir", "--output-dir", type=os.path.abspath, help="path to
 parser.add_argument("--rep", "--replicate", "-n", type=int,
                     help="number of replicates to execute per simulation",
                     dest="replicates", default=1)
-parser.add_argument("--prefix", type=str, help="prefix of output files",
-                    default=f"scd_{int(datetime.timestamp(datetime.now()))}")
+parser.add_argument("--prefix", type=str, help="prefix of output files (default: scd_<timestamp>)",
+                    default=None)
 parser.add_argument("-t", "--thread", "--threads", type=int,
                     help="number of parallel processes",
                     dest="threads", default=1)
@@ -45,23 +53,166 @@ parser.add_argument("--zip-rep", "--zip-replicates", action="store_true", dest="
 #                           " (does not affect simulations themselves, but does provide some"
 #                           " peace of mind to know that the programme is still running)"),
 #                     default=20)
+parser.add_argument("--zip-compression", choices=["deflate", "stored", "bzip2", "lzma", "zstd"],
+                    dest="zip_compression", default="deflate",
+                    help=("compression method of zip files (default: deflate);"
+                          " zstd requires a Python version whose zipfile module supports it"))
+parser.add_argument("--zip-level", type=int, dest="zip_level", default=None,
+                    help=("compression level of zip files (-1-9 for deflate, 1-9 for bzip2, not used by stored"
+                          " and lzma; lower is faster; default: zipfile's default for the compression method)"))
+parser.add_argument("--scratch-dir", type=os.path.abspath, dest="dir_scratch", default=None,
+                    help=("write each combination's .txt, .slim and SLiM output files to this (e.g. local)"
+                          " directory, and only write the zip file(s) (or, without --zip, the completed"
+                          " combination directory) to --dir once all of its replicates are done"))
+parser.add_argument("--store", choices=["directories", "sqlite"], dest="store", default="directories",
+                    help=("directories: write each combination to its own directory (or zip file, see --zip);"
+                          " sqlite: store the files of all combinations in a single <prefix>.sqlite database"
+                          " in --dir (combinations are executed in --scratch-dir, or a temporary directory,"
+                          " and added to the database once complete) (default: directories)"))
+parser.add_argument("--dedup", "--deduplicate", action="store_true", dest="dedup",
+                    help=("execute SLiM only once per unique .slim script;"
+                          " duplicate combinations are recorded in <prefix>_dedup.txt"))
+parser.add_argument("--resume", action="store_true", dest="resume",
+                    help=("skip combinations and replicates completed by a previous run with the same"
+                          " --dir and --prefix (as recorded in <prefix>_manifest.txt);"
+                          " outputs of combinations whose .slim script has changed are deleted and regenerated"))
+## "K/N" -> (K, N)
+def parse_shard(s):
+    try:
+        shard, num_shards = [int(e) for e in s.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must be in the format K/N (e.g. 1/4), not '{s}'.")
+    if not (1 <= shard <= num_shards):
+        raise argparse.ArgumentTypeError(f"Shard K/N must satisfy 1 <= K <= N, not '{s}'.")
+    return (shard, num_shards)
+parser.add_argument("--shard", type=parse_shard, metavar="K/N", dest="shard", default=None,
+                    help=("execute only the K-th of N slices of substitution IDs (e.g. on node K of N);"
+                          " requires --prefix. Run --merge-shards N after all shards are done"))
+parser.add_argument("--shard-mode", choices=["contiguous", "strided"], dest="shard_mode",
+                    default="contiguous",
+                    help=("contiguous: shard K executes a block of consecutive substitution IDs;"
+                          " strided: shard K executes substitution IDs K, K+N, K+2N... (default: contiguous)"))
+parser.add_argument("--merge-shards", type=int, metavar="N", dest="merge_shards", default=None,
+                    help=("check that all N shards of a --shard run have completed all combinations"
+                          " and merge their manifests; does not execute anything"))
+## positive int or "auto"
+def parse_chunksize(s):
+    if s == "auto":
+        return None
+    try:
+        chunksize = int(s)
+    except ValueError:
+        chunksize = 0
+    if chunksize < 1:
+        raise argparse.ArgumentTypeError(f"Chunk size must be a positive integer or 'auto', not '{s}'.")
+    return chunksize
+parser.add_argument("--chunksize", type=parse_chunksize, dest="chunksize", default=None,
+                    help=("number of combinations sent to each process at a time for script generation"
+                          " (replicates are always sent individually);"
+                          " default: auto (up to 30, so that each process gets at least 4 chunks)"))
+parser.add_argument("--cost-variable", type=str, dest="cost_variable", default=None,
+                    help=("execute combinations with the largest (numeric) value of this variable first"
+                          " (e.g. POPULATION_SIZE), so that the slowest simulations do not run last"))
+parser.add_argument("--cost-manifest", type=os.path.abspath, dest="cost_manifest", default=None,
+                    help=("execute combinations with the longest mean replicate runtime in this"
+                          " <prefix>_manifest.txt (of a previous run of the same recipe) first"))
+parser.add_argument("--plan", action="store_true", dest="plan",
+                    help=("print the number of combinations (per alternative block), SLiM runs and output files"
+                          " and exit without building any scripts; use with --plan-sample to also estimate"
+                          " SLiM CPU time and disk usage"))
+parser.add_argument("--plan-sample", type=int, metavar="N", dest="plan_sample", default=0,
+                    help=("with --plan, build N evenly spaced combinations and execute one replicate of each"
+                          " (in a temporary directory) to estimate SLiM CPU time and disk usage of the run"))
+parser.add_argument("--profile-startup", action="store_true", dest="profile_startup",
+                    help="print time taken to import modules, parse the recipe and build the first script")
+parser.add_argument("--profile", action="store_true", dest="profile",
+                    help=("print the wall time spent in each stage (building scripts, writing files, SLiM, zipping,"
+                          " ...) summed across all processes, and throughput, at the end of the run"))
+parser.add_argument("--timings-json", type=os.path.abspath, metavar="FILE", dest="timings_json", default=None,
+                    help="write the wall time of each stage of each task (and the --profile summary) to a JSON file")
+parser.add_argument("--profile-worker", type=os.path.abspath, metavar="FILE", dest="profile_worker", default=None,
+                    help=("run cProfile in one worker process (the main process if --threads 1) and write its stats"
+                          " to FILE (e.g. <prefix>.prof; see python3 -m pstats)"))
+parser.add_argument("--metrics", type=os.path.abspath, metavar="FILE", dest="metrics", default=None,
+                    help=("periodically write progress and throughput metrics to FILE (JSON, or Prometheus text"
+                          " format if FILE ends with .prom), e.g. for monitoring long sweeps"))
+parser.add_argument("--metrics-interval", type=float, metavar="SECONDS", dest="metrics_interval", default=30,
+                    help="seconds between updates of --metrics (default: 30)")
+parser.add_argument("--timeout", type=float, metavar="SECONDS", dest="timeout", default=None,
+                    help="kill SLiM replicates that run for longer than this (wall-clock time)")
+parser.add_argument("--max-memory", type=int, metavar="MB", dest="max_memory", default=None,
+                    help=("limit the virtual memory (RLIMIT_AS) of each SLiM replicate to this;"
+                          " SLiM exits with an error if it cannot allocate memory"))
+parser.add_argument("--retries", type=int, dest="retries", default=0,
+                    help=("number of times to re-execute a failed (or timed out) SLiM replicate (default: 0);"
+                          " combinations with replicates that still fail are not zipped or marked complete,"
+                          " and the rest of the sweep continues"))
+parser.add_argument("--append-outputs", action="store_true", dest="append_outputs",
+                    help=("append SLiM output files that several replicates of a combination write under the same"
+                          " name (e.g. with writeFile(..., append=T)) to each other, instead of keeping the file"
+                          " of the replicate that finished last"))
+parser.add_argument("--cache-dir", type=os.path.abspath, dest="dir_cache", default=None,
+                    help=("directory of a cache of SLiM outputs shared between runs; replicates are executed"
+                          " with deterministic seeds and those with an identical script, seed and SLiM version"
+                          " are copied from the cache instead of being executed"))
+parser.add_argument("--cache-ignore-substitution-id", action="store_true", dest="cache_ignore_substitution_id",
+                    help=("share cache entries between scripts that only differ in SUBSTITUTION_ID (e.g. the same"
+                          " combination in an extended sweep); only use if outputs do not depend on SUBSTITUTION_ID"))
+parser.add_argument("--cache-max-size", type=int, metavar="MB", dest="cache_max_size", default=None,
+                    help="evict least recently used outputs from --cache-dir once it is larger than this")
 parser.add_argument("--slim", type=str,
                     help="full path to slim executable; ignore if executable is in path",
                     dest="exe_slim", default=None)
 args = parser.parse_args()
+startup_times["parse arguments"] = time.perf_counter() - startup_start - sum(startup_times.values())
+if args.store == "sqlite" and (args.zip or args.zip_reps):
+    parser.error("--zip and --zip-rep cannot be used with --store sqlite")
+if (args.shard is not None or args.merge_shards is not None) and args.prefix is None:
+    parser.error("--shard and --merge-shards require --prefix (which must be identical for all shards)")
+if (args.cache_max_size is not None or args.cache_ignore_substitution_id) and args.dir_cache is None:
+    parser.error("--cache-max-size and --cache-ignore-substitution-id require --cache-dir")
 
 test_args_only = False
 
 f_recipe = args.recipe
 module_paths = list(itertools.chain(*args.module_paths))
 module_paths = module_paths + [path for path in default_module_paths if path not in module_paths]
-prefix = args.prefix
+prefix = f"scd_{int(datetime.timestamp(datetime.now()))}" if args.prefix is None else args.prefix
 dir_output = args.dir_output
 replicates = args.replicates
 to_zip = args.zip
 zip_reps = args.zip_reps
 threads = args.threads
+dedup = args.dedup
+resume = args.resume
+shard = args.shard
 exe_slim = "slim" if args.exe_slim is None else args.exe_slim
+dir_scratch = args.dir_scratch
+store = args.store
+if store == "sqlite" and dir_scratch is None:
+    import tempfile
+    dir_scratch = os.path.join(tempfile.gettempdir(), f"slimerge_{prefix}")
+zip_compression = args.zip_compression
+zip_level = args.zip_level
+
+## range of --zip-level of a compression method, or None if zipfile ignores the level (stored, lzma)
+def zip_level_range(method):
+    if method == "zstd":
+        ## (zstd is only available in zipfile in Python 3.14+; otherwise zip_settings fails later)
+        try:
+            from compression import zstd
+        except ImportError:
+            return (None, None)
+        return zstd.CompressionParameter.compression_level.bounds()
+    return {"deflate": (-1, 9), "bzip2": (1, 9), "stored": None, "lzma": None}[method]
+
+## fail before executing anything if the level is not valid for the compression method
+if zip_level is not None:
+    if zip_level_range(zip_compression) is None:
+        parser.error(f"--zip-level has no effect with --zip-compression {zip_compression}")
+    low, high = zip_level_range(zip_compression)
+    if (low is not None and zip_level < low) or (high is not None and zip_level > high):
+        parser.error(f"--zip-level must be between {low} and {high} with --zip-compression {zip_compression}")
 
 print("recipe:", f_recipe)
 print("module_paths:", module_paths)
@@ -70,7 +221,22 @@ print("replicates:", replicates)
 print("prefix:", prefix)
 print("zip:", to_zip)
 print("zip replicates:", zip_reps)
+print("zip compression:", zip_compression + ('' if zip_level is None else f" (level {zip_level})"))
+print("scratch directory:", dir_scratch)
+print("store:", store)
 print("threads:", threads)
+print("dedup:", dedup)
+print("resume:", resume)
+print("chunksize:", "auto" if args.chunksize is None else args.chunksize)
+print("order by:", args.cost_variable or args.cost_manifest or "substitution ID")
+print("timeout:", args.timeout)
+print("max memory:", "none" if args.max_memory is None else f"{args.max_memory} MB")
+print("retries:", args.retries)
+print("append outputs:", args.append_outputs)
+print("cache:", "none" if args.dir_cache is None else
+      args.dir_cache + ('' if args.cache_max_size is None else f" (max {args.cache_max_size} MB)")
+      + (" (ignoring SUBSTITUTION_ID)" if args.cache_ignore_substitution_id else ''))
+print("shard:", "none" if shard is None else f"{shard[0]}/{shard[1]} ({args.shard_mode})")
 # print("progress increment:", args.progress_increment)
 
 if test_args_only:
@@ -89,52 +255,735 @@ def mkfname_scriptfile(*args):
 def mkfname_zip(*args):
     return f"{mk_run_prefix(*args)}.zip"
 
+## manifests are written separately for each shard (--shard K/N) and merged by --merge-shards
+def mk_shard_suffix(shard):
+    return '' if shard is None else f".shard{shard[0]}of{shard[1]}"
+
+## manifest of duplicate scripts (--dedup)
+def mkfname_dedup(dir_output, prefix, shard = None):
+    return os.path.join(dir_output, f"{prefix}_dedup{mk_shard_suffix(shard)}.txt")
+
+## database of all combinations' files (--store sqlite)
+def mkfname_store(dir_output, prefix, shard = None):
+    return os.path.join(dir_output, f"{prefix}{mk_shard_suffix(shard)}.sqlite")
+
+## manifest of completed replicates and combinations (--resume)
+def mkfname_manifest(dir_output, prefix, shard = None):
+    return os.path.join(dir_output, f"{prefix}_manifest{mk_shard_suffix(shard)}.txt")
+
+## manifest of this run (see manifest_columns in run_tracker.py)
+f_manifest = mkfname_manifest(dir_output, prefix, shard)
+
 # print("Not args checking mode")
 
+## execute SLiM once and return its exit status ("timeout" if killed after 'timeout' seconds),
+## wall-clock time and resource usage. max_memory (MB) limits the process's virtual memory (Linux only)
+## (SLiM's output to stdout is discarded if quiet = True; SLiM picks a random seed if seed is None)
+def run_slim(f_scriptfile, timeout = None, max_memory = None, quiet = False, seed = None):
+    import signal
+    import resource
+    import threading
+    import subprocess
+    ## (the limit is set in the child process before SLiM is executed; limit_memory only calls setrlimit,
+    ##  which is safe in preexec_fn while other threads (--timeout, --metrics) are running)
+    limit = None if max_memory is None else (max_memory * 1024 * 1024, max_memory * 1024 * 1024)
+    def limit_memory():
+        resource.setrlimit(resource.RLIMIT_AS, limit)
+    start = time.perf_counter()
+    process = subprocess.Popen(args = [exe_slim, "-l", "0"] + ([] if seed is None else ["-s", str(seed)])
+                               + [f_scriptfile],
+                               stdout = subprocess.DEVNULL if quiet else None,
+                               preexec_fn = None if limit is None else limit_memory)
+    ## the process is only killed (by the timer) while it has not been reaped, so that its pid cannot
+    ## have been reused
+    lock = threading.Lock()
+    timed_out = threading.Event()
+    def kill():
+        with lock:
+            if process.returncode is None:
+                timed_out.set()
+                os.kill(process.pid, signal.SIGKILL)
+    timer = None if timeout is None else threading.Timer(timeout, kill)
+    if timer is not None: timer.start()
+    ## wait for the process to exit without reaping it, then reap it (os.wait4 returns the resource usage
+    ## of this process only)
+    os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    with lock:
+        pid, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if timer is not None: timer.cancel()
+    ## (a process that exited by itself just before the timer fired is not recorded as timed out)
+    timed_out = timed_out.is_set() and process.returncode == -signal.SIGKILL
+    return {"exit_status": "timeout" if timed_out else process.returncode,
+            "seconds": time.perf_counter() - start,
+            "user_seconds": rusage.ru_utime, "sys_seconds": rusage.ru_stime,
+            "max_rss_kb": rusage.ru_maxrss}
+
+## substitution IDs of shard K of N
+def shard_substitution_ids(num_combos, shard, num_shards, strided = False):
+    if strided:
+        return range(shard, num_combos + 1, num_shards)
+    ## the first (num_combos % num_shards) shards each get one extra combination
+    size, extra = divmod(num_combos, num_shards)
+    start = (shard - 1) * size + min(shard - 1, extra) + 1
+    return range(start, start + size + (1 if shard <= extra else 0))
+
 ## parse recipe file
 recipe_file = RecipeFile(fname = f_recipe, module_paths = module_paths)
-recipe_combos = recipe_file.substitution_files()
+startup_times["parse recipe"] = time.perf_counter() - startup_start - sum(startup_times.values())
 print(f"Number of combinations: {recipe_file.num_combos()}")
+if shard is None:
+    combo_ids = range(1, recipe_file.num_combos() + 1)
+    num_combos = len(combo_ids)
+    recipe_combos = recipe_file.substitution_files()
+else:
+    ## only build combinations in this shard
+    combo_ids = shard_substitution_ids(recipe_file.num_combos(), *shard,
+                                       strided = (args.shard_mode == "strided"))
+    num_combos = len(combo_ids)
+    recipe_combos = recipe_file.substitution_files(combo_ids)
+    print(f"Number of combinations in shard {shard[0]}/{shard[1]}: {num_combos}")
 
-## make substitution files + their scripts and run and then zip each combo separately
-def parse_combo(substitution_file):
+## expected cost of each combination, or None if unknown
+def combo_costs(combo_ids):
+    if args.cost_manifest is not None:
+        runs = read_manifest(args.cost_manifest)
+        for sub_id in combo_ids:
+            seconds = runs.get(sub_id, {}).get("seconds")
+            yield (sum(seconds) / len(seconds)) if seconds else None
+        return
+    for substitution_file in recipe_file.substitution_files(combo_ids):
+        ## (largest value if the variable is defined in multiple blocks)
+        values = []
+        for block in substitution_file.blocks():
+            try:
+                values.append(float(block.variables[args.cost_variable]))
+            except (KeyError, ValueError):
+                continue
+        yield max(values) if values else None
+    return
+
+## execute combinations with the largest expected cost first (combinations with unknown cost go first)
+if args.cost_variable is not None or args.cost_manifest is not None:
+    costs = dict(zip(combo_ids, combo_costs(combo_ids)))
+    combo_ids = sorted(combo_ids, key = lambda sub_id: (costs[sub_id] is not None,
+                                                        -(costs[sub_id] or 0), sub_id))
+    recipe_combos = recipe_file.substitution_files(combo_ids)
+    print(f"Combinations with unknown cost: {sum(cost is None for cost in costs.values())}")
+
+## check that all shards are complete and merge their manifests (--merge-shards)
+def merge_shards(num_shards):
+    runs = {}
+    for i in range(1, num_shards + 1):
+        f_shard_manifest = mkfname_manifest(dir_output, prefix, (i, num_shards))
+        if not os.path.exists(f_shard_manifest):
+            print(f"Missing manifest for shard {i}/{num_shards}: {f_shard_manifest}")
+            continue
+        runs.update(read_manifest(f_shard_manifest))
+    incomplete = [sub_id for sub_id in range(1, recipe_file.num_combos() + 1)
+                  if sub_id not in runs or not runs[sub_id]["complete"]]
+    if incomplete:
+        print(f"{len(incomplete)} incomplete combination(s), e.g. substitution ID(s):",
+              ', '.join([str(sub_id) for sub_id in incomplete[:20]]))
+        return False
+    ## concatenate shard manifests (and duplicate scripts, if any)
+    for mkfname, columns in ((mkfname_manifest, manifest_columns),
+                             (mkfname_dedup, dedup_columns)):
+        fnames = [mkfname(dir_output, prefix, (i, num_shards)) for i in range(1, num_shards + 1)]
+        if not any(os.path.exists(fname) for fname in fnames):
+            continue
+        with open(mkfname(dir_output, prefix), "w+") as f_out:
+            f_out.write('\t'.join(columns) + '\n')
+            for fname in fnames:
+                if not os.path.exists(fname): continue
+                with open(fname, 'r') as f:
+                    for line in f:
+                        if line.split('\t')[0] != columns[0]:
+                            f_out.write(line)
+    ## merge databases (--store sqlite)
+    fnames = [mkfname_store(dir_output, prefix, (i, num_shards)) for i in range(1, num_shards + 1)]
+    if any(os.path.exists(fname) for fname in fnames):
+        from output_store import OutputStore
+        with OutputStore(mkfname_store(dir_output, prefix)) as output_store:
+            for fname in fnames:
+                if os.path.exists(fname): output_store.merge(fname)
+    print(f"All {recipe_file.num_combos()} combinations in {num_shards} shard(s) are complete;"
+          f" merged manifest written to {mkfname_manifest(dir_output, prefix)}")
+    return True
+
+if args.merge_shards is not None:
+    sys.exit(0 if merge_shards(args.merge_shards) else 1)
+
+## number of combinations of each alternative block (in the whole recipe), e.g.
+## "{ 2 } | { 4 }" in a recipe with 3 other combinations -> [6, 12]
+def print_plan_alt_blocks(recipe, multiplier = 1, indentation = '  '):
+    blocks = [block for block in recipe.blocks if block is not None]
+    for i, block in enumerate(blocks):
+        if not isinstance(block, RecipeBlockAlt): continue
+        others = multiplier * recipe.num_combos() // block.num_combos() if block.num_combos() else 0
+        print(f"{indentation}alternative block ({len(block.recipes)} alternatives):")
+        for j, alt_recipe in enumerate(block.recipes):
+            print(f"{indentation}  {j+1}: {others * alt_recipe.num_combos()} combination(s)")
+            print_plan_alt_blocks(alt_recipe, multiplier = others, indentation = indentation + "    ")
+    return
+
+## total size (bytes) and number of files in a directory
+def dir_usage(dir_path):
+    size, num_files = 0, 0
+    for root, dirs, files in os.walk(dir_path):
+        for fname in files:
+            size += os.path.getsize(os.path.join(root, fname))
+            num_files += 1
+    return size, num_files
+
+def format_bytes(size):
+    for unit in ['B', "KB", "MB", "GB", "TB"]:
+        if size < 1024 or unit == "TB": break
+        size /= 1024
+    return f"{size:.1f} {unit}"
+
+## execute one replicate of each of 'num_samples' evenly spaced combinations in a temporary directory
+## returns [(CPU seconds, bytes of .txt + .slim files, bytes of SLiM output, number of SLiM output files)]
+def plan_sample(num_samples):
+    sample_ids = [combo_ids[i * len(combo_ids) // num_samples] for i in range(min(num_samples, len(combo_ids)))]
+    samples = []
+    import tempfile
+    with tempfile.TemporaryDirectory() as dir_tmp:
+        for sub_id in sample_ids:
+            dir_sub = os.path.join(dir_tmp, str(sub_id))
+            dir_slimoutput = os.path.join(dir_sub, "slim_out")
+            os.makedirs(dir_slimoutput)
+            substitution_file = recipe_file.substitution_file(sub_id)
+            f_scriptfile = os.path.join(dir_sub, "script.slim")
+            with open(os.path.join(dir_sub, "substitution.txt"), "w+") as f:
+                f.write(substitution_file.generate_string().replace("$OUTPUT_DIRECTORY$", f"\"{dir_slimoutput}\""))
+            with open(f_scriptfile, "w+") as f:
+                f.write(substitution_file.build_script().make_string().replace("$OUTPUT_DIRECTORY$",
+                                                                               f"\"{dir_slimoutput}\""))
+            input_size = dir_usage(dir_sub)[0]
+            usage = run_slim(f_scriptfile, timeout = args.timeout, max_memory = args.max_memory, quiet = True)
+            if usage["exit_status"] != 0:
+                raise Exception(f"SLiM failed on substitution ID {sub_id} (exit status: {usage['exit_status']}).")
+            cpu_seconds = usage["user_seconds"] + usage["sys_seconds"]
+            samples.append((cpu_seconds, input_size, *dir_usage(dir_slimoutput)))
+            print(f"  substitution ID {sub_id}: {cpu_seconds:.2f} CPU seconds,"
+                  f" {format_bytes(samples[-1][2])} in {samples[-1][3]} SLiM output file(s)")
+    return samples
+
+## pre-flight report (--plan); does not build any scripts unless --plan-sample is used
+def print_plan():
+    num_runs = num_combos * replicates
+    print(f"Combinations to execute: {num_combos}"
+          + ('' if shard is None else f" (shard {shard[0]}/{shard[1]} of {recipe_file.num_combos()})"))
+    print_plan_alt_blocks(recipe_file.recipe)
+    print(f"SLiM runs: {num_runs} ({replicates} replicate(s) per combination)")
+    ## one .txt and one .slim file per combination, and one directory (or .zip if --zip)
+    print(f"Output files (excluding SLiM output): {2 * num_combos} in {num_combos}"
+          f" {'.zip file(s)' if to_zip else 'directories'}")
+    if args.plan_sample <= 0 or num_combos == 0:
+        return
+    print(f"Executing one replicate of {min(args.plan_sample, num_combos)} combination(s):")
+    samples = plan_sample(args.plan_sample)
+    mean = lambda l: sum(l) / len(l)
+    cpu_seconds, input_size, output_size, num_output_files = [mean(l) for l in zip(*samples)]
+    print(f"Estimated SLiM CPU time: {cpu_seconds * num_runs / 3600:.2f} CPU-hours"
+          f" ({cpu_seconds * num_runs / 3600 / threads:.2f} hours with {threads} thread(s))")
+    print(f"Estimated SLiM output files: {round(num_output_files * num_runs)}")
+    print(f"Estimated disk usage: {format_bytes(input_size * num_combos + output_size * num_runs)}"
+          + (" before compression" if to_zip or zip_reps else ''))
+    return
+
+if args.plan:
+    print_plan()
+    sys.exit(0)
+
+## hash of script before $OUTPUT_DIRECTORY$ is substituted (i.e. independent of combination's directory)
+def hash_script(script_string):
+    return hashlib.sha256(script_string.encode()).hexdigest()
+
+## replicates and combinations completed by a previous run (--resume)
+previous_runs = read_manifest(f_manifest) if resume else {}
+## {script hash: substitution ID of the combination executed for that script} of a previous run
+## (--dedup --resume), so that the same combinations are executed again (if their script is unchanged)
+previous_canonical_ids = {script_hash: sub_id for script_hash, sub_id in
+                          read_dedup(mkfname_dedup(dir_output, prefix, shard)).items()
+                          if previous_runs.get(sub_id, {}).get("script_hash") == script_hash} \
+                         if resume and dedup else {}
+
+## cache of SLiM outputs shared between runs (--cache-dir); entries are specific to a SLiM version
+result_cache = None
+slim_version = None
+if args.dir_cache is not None:
+    import subprocess
+    from result_cache import ResultCache
+    try:
+        slim_version = subprocess.run([exe_slim, "-v"], capture_output = True, text = True,
+                                      check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) as e:
+        parser.error(f"--cache-dir requires the SLiM version, but '{exe_slim} -v' failed: {e}")
+    result_cache = ResultCache(args.dir_cache, max_size = None if args.cache_max_size is None else
+                               args.cache_max_size * 1024 * 1024)
+    result_cache.evict()
+
+## script with SUBSTITUTION_ID left as a placeholder, whose hash is used as key of the cache, so that
+## identical scripts of different sweeps (where the same combination usually has a different substitution ID)
+## share cache entries (--cache-ignore-substitution-id); SUBSTITUTION_ID is then substituted into its string
+def build_script_normalised(substitution_file):
+    sub_id = substitution_file.substitution_id
+    substitution_file.substitution_id = "$SUBSTITUTION_ID$"
+    try:
+        return substitution_file.build_script()
+    finally:
+        substitution_file.substitution_id = sub_id
+
+## deterministic seed of replicate i of a script (--cache-dir)
+def replicate_seed(cache_hash, i):
+    ## (SLiM seeds are 64-bit integers; 60 bits are used so that they are always positive)
+    return int(hashlib.sha256(f"{cache_hash}:{i}".encode()).hexdigest()[:15], 16)
+
+## directory in which a combination's files are written while its replicates are executed
+## (moved or zipped to dir_sub by finish_combo if --scratch-dir is used)
+def mk_work_dir(dir_sub):
+    return dir_sub if dir_scratch is None else os.path.join(dir_scratch, os.path.basename(dir_sub))
+
+## zipfile compression method and level
+def zip_settings():
+    import zipfile
+    methods = {"deflate": zipfile.ZIP_DEFLATED, "stored": zipfile.ZIP_STORED,
+               "bzip2": zipfile.ZIP_BZIP2, "lzma": zipfile.ZIP_LZMA,
+               "zstd": getattr(zipfile, "ZIP_ZSTANDARD", None)}
+    if methods[zip_compression] is None:
+        raise ValueError(f"Compression method '{zip_compression}' is not supported by this Python version's zipfile.")
+    return {"compression": methods[zip_compression], "compresslevel": zip_level}
+
+## zip root_dir/base_dir into f_zip, with the same layout as shutil.make_archive
+## (f_zip is only created once complete, so an interrupted run does not leave a truncated zip file)
+def write_zip(f_zip, root_dir, base_dir):
+    import zipfile
+    with zipfile.ZipFile(f"{f_zip}.part", 'w', **zip_settings()) as f:
+        for root, dirs, files in os.walk(os.path.join(root_dir, base_dir)):
+            dirs.sort()
+            arc_root = os.path.relpath(root, root_dir)
+            f.write(root, arc_root)
+            for fname in sorted(files):
+                ## (file contents are read and compressed in chunks)
+                f.write(os.path.join(root, fname), os.path.join(arc_root, fname))
+    os.replace(f"{f_zip}.part", f_zip)
+    return
+
+## delete outputs of a combination (zipped or not)
+def remove_outputs(dir_sub):
+    import shutil
+    for dir_path in set([dir_sub, mk_work_dir(dir_sub)]):
+        if os.path.isdir(dir_path):
+            shutil.rmtree(dir_path)
+    if os.path.exists(f"{dir_sub}.zip"):
+        os.remove(f"{dir_sub}.zip")
+    return
+
+## restore (zipped) outputs of a partially completed combination to its working directory
+## (see mk_work_dir) so that it can be resumed
+def unzip_outputs(dir_sub, dir_work):
+    import shutil
+    dir_slimoutput = os.path.join(dir_work, "slim_out")
+    if os.path.exists(f"{dir_sub}.zip") and not os.path.isdir(dir_work):
+        shutil.unpack_archive(f"{dir_sub}.zip", os.path.dirname(dir_work))
+        os.remove(f"{dir_sub}.zip")
+    elif os.path.isdir(dir_sub) and not os.path.isdir(dir_work):
+        shutil.move(dir_sub, dir_work)
+    if os.path.exists(f"{dir_slimoutput}.zip") and not os.path.isdir(dir_slimoutput):
+        shutil.unpack_archive(f"{dir_slimoutput}.zip", dir_work)
+        os.remove(f"{dir_slimoutput}.zip")
+    return
+
+## restore outputs of a combination completed by a previous run from the database (--store sqlite)
+def restore_stored_outputs(sub_id, dir_work):
+    if os.path.isdir(dir_work) or not os.path.exists(f_store):
+        return
+    from output_store import OutputStore
+    with OutputStore(f_store) as output_store:
+        if sub_id in output_store:
+            output_store.extract(sub_id, os.path.dirname(dir_work))
+    return
+
+## add time since 'start' to timings[stage] and return the current time
+## (each task measures the wall time of its stages as {stage: seconds}, which is returned to the
+##  main process and aggregated by RunTracker.record_timings for --profile and --timings-json)
+def add_time(timings, stage, start):
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+## make substitution files + their scripts; replicates are then executed with run_replicate
+## (in parallel across combinations and replicates) and each combination is zipped once by finish_combo
+def prepare_combo(substitution_file, timings = None):
+    timings = {} if timings is None else timings
+    t = time.perf_counter()
     ## make file names
     sub_id = substitution_file.substitution_id
     ## all files generated from this substitution file iteration will be written within dir_sub
+    ## (or first within dir_work in the scratch directory, if any)
     dir_sub = mk_run_prefix(dir_output, prefix, sub_id)
-    mk_args = [dir_sub, prefix, sub_id]
+    dir_work = mk_work_dir(dir_sub)
+    mk_args = [dir_work, prefix, sub_id]
     f_subfile = mkfname_subfile(*mk_args)
     f_scriptfile = mkfname_scriptfile(*mk_args)
-    dir_slimoutput = os.path.join(dir_sub, "slim_out")
+    dir_slimoutput = os.path.join(dir_work, "slim_out")
+    ## build script (only once, also if --cache-ignore-substitution-id is used)
+    if args.cache_ignore_substitution_id:
+        script = build_script_normalised(substitution_file)
+    else:
+        script = substitution_file.build_script()
+    t = add_time(timings, "build_script", t)
+    script_string = script.make_string()
+    t = add_time(timings, "make_string", t)
+    cache_hash = None
+    if args.cache_ignore_substitution_id:
+        cache_hash = hash_script(script_string)
+        script_string = substitute_string(script_string, {"SUBSTITUTION_ID": str(sub_id)})
+    ## only the first combination with a given script is executed if deduplicating; this is decided
+    ## by the main process (RunTracker.record_prepared), apart from combinations that were
+    ## duplicates in a previous run (--resume)
+    script_hash = hash_script(script_string)
+    canonical_id = previous_canonical_ids.get(script_hash, sub_id)
+    ## report this process's module cache usage so the parent can aggregate it across workers
+    result = {"substitution_id": sub_id, "script_hash": script_hash, "canonical_id": canonical_id,
+              "resumed": False, "pid": os.getpid(),
+              "module_cache": (module_cache.hits, module_cache.misses),
+              "replicates_todo": [], "num_replicates": 0, "failed": False,
+              "cache_hash": script_hash if cache_hash is None else cache_hash,
+              "timings": timings}
+    t = add_time(timings, "hash script", t)
+    ## skip combinations completed by a previous run (--resume)
+    previous = previous_runs.get(sub_id)
+    if previous is not None and previous["script_hash"] != script_hash:
+        remove_outputs(dir_sub)
+        previous = None
+    ## replicates in a scratch directory that no longer exists (e.g. on another node) must be executed again
+    if previous is not None and not previous["complete"] and dir_work != dir_sub and not os.path.isdir(dir_work):
+        remove_outputs(dir_sub)
+        previous = None
+    replicates_done = set() if previous is None else previous["replicates"]
+    replicates_todo = [] if canonical_id != sub_id else \
+        [i for i in range(1, replicates + 1) if i not in replicates_done]
+    result["replicates_todo"] = replicates_todo
+    result["num_replicates"] = len(replicates_done) + len(replicates_todo)
+    if previous is not None:
+        if previous["complete"] and not replicates_todo:
+            result["resumed"] = True
+            return result
+        if store == "sqlite":
+            restore_stored_outputs(sub_id, dir_work)
+        else:
+            unzip_outputs(dir_sub, dir_work)
+        t = add_time(timings, "restore outputs", t)
     os.makedirs(dir_slimoutput, exist_ok = True)
-    ## write files
+    ## write files (with the final output directory, also if they are written to the scratch directory
+    ## or stored in the database; see run_replicate)
+    dir_slimoutput_final = os.path.join(dir_sub, "slim_out")
     with open(f_subfile, "w+") as f:
-        f.write(substitution_file.generate_string().replace("$OUTPUT_DIRECTORY$", f"\"{dir_slimoutput}\""))
+        f.write(substitution_file.generate_string().replace("$OUTPUT_DIRECTORY$", f"\"{dir_slimoutput_final}\""))
     with open(f_scriptfile, "w+") as f:
-        script = substitution_file.build_script()
-        f.write(script.make_string().replace("$OUTPUT_DIRECTORY$", f"\"{dir_slimoutput}\""))
-    ## execute slim 'replicates' number of times
-    for i in range(replicates):
-        subprocess.run(args = [exe_slim, "-l", "0", f_scriptfile], check = True)
+        f.write(script_string.replace("$OUTPUT_DIRECTORY$", f"\"{dir_slimoutput_final}\""))
+    add_time(timings, "write files", t)
+    return result
+
+## worker processes rebuild combinations from their own copy of recipe_file (and its module and
+## defaults caches), so that only substitution IDs have to be sent to the pool
+def prepare_combo_id(sub_id):
+    start = time.perf_counter()
+    substitution_file = recipe_file.substitution_file(sub_id)
+    return prepare_combo(substitution_file, {"substitution file": time.perf_counter() - start})
+
+## move the files of a successful replicate from dir_src to dir_dest (slim_out). Files that already exist
+## in dir_dest (i.e. written by another replicate under the same name) are replaced, as if the replicates
+## had written to dir_dest directly, or appended to with --append-outputs (e.g. for writeFile(append = T)).
+## Returns True if any file already existed
+def move_outputs(dir_src, dir_dest):
+    import fcntl
+    import shutil
+    collided = False
+    for root, dirs, files in os.walk(dir_src):
+        dir_root = os.path.join(dir_dest, os.path.relpath(root, dir_src))
+        os.makedirs(dir_root, exist_ok = True)
+        for fname in sorted(files):
+            src = os.path.join(root, fname)
+            dest = os.path.join(dir_root, fname)
+            ## (os.link fails if dest exists, even if another process creates it at the same time)
+            try:
+                os.link(src, dest)
+            except FileExistsError:
+                collided = True
+                if not args.append_outputs:
+                    os.replace(src, dest)
+                    continue
+                with open(src, "rb") as f_src, open(dest, "ab") as f_dest:
+                    fcntl.flock(f_dest, fcntl.LOCK_EX)
+                    shutil.copyfileobj(f_src, f_dest)
+            os.remove(src)
+    return collided
+
+## execute replicate i of a combination prepared by prepare_combo
+## (retried up to --retries times if it fails; failures are recorded in the manifest instead of raised).
+## each attempt writes to its own directory, which is moved to slim_out (see move_outputs) only if the
+## attempt succeeds, so that partial outputs of failed attempts are discarded.
+## with --cache-dir, outputs are taken from the cache if possible, and otherwise added to it. Scripts whose
+## replicates write files with the same name (i.e. a file in slim_out is not only one replicate's output)
+## are excluded from the cache once this is detected (and recorded as 'excluded' in the manifest)
+def run_replicate(sub_id, script_hash, i, cache_hash = None):
+    import shutil
+    timings = {}
+    dir_sub = mk_run_prefix(dir_output, prefix, sub_id)
+    dir_work = mk_work_dir(dir_sub)
+    f_scriptfile = mkfname_scriptfile(dir_work, prefix, sub_id)
+    dir_slimoutput = os.path.join(dir_work, "slim_out")
+    dir_replicate = f"{dir_slimoutput}_replicate{i}"
+    seed = None
+    cache_status = ''
+    start = time.perf_counter()
+    if result_cache is not None:
+        seed = replicate_seed(cache_hash, i)
+        key = result_cache.key(cache_hash, seed, slim_version)
+        cache_status = "excluded" if result_cache.excluded(cache_hash) else "miss"
+        if cache_status == "miss":
+            if os.path.isdir(dir_replicate): shutil.rmtree(dir_replicate)
+            os.makedirs(dir_replicate)
+            usage = result_cache.get(key, dir_replicate)
+            if usage is not None:
+                if move_outputs(dir_replicate, dir_slimoutput):
+                    result_cache.exclude(cache_hash)
+                shutil.rmtree(dir_replicate)
+                add_time(timings, "cache", start)
+                ## (resource usage of the original execution, so that e.g. --cost-manifest is not skewed)
+                append_manifest(f_manifest, sub_id, script_hash, "replicate", i, 0, f"{usage['seconds']:.3f}",
+                                f"{usage['user_seconds']:.3f}", f"{usage['sys_seconds']:.3f}", usage["max_rss_kb"],
+                                1, "hit")
+                return (sub_id, i, True, True, timings, os.getpid())
+        start = add_time(timings, "cache", start)
+    ## (the combination's script refers to the final output directory; see prepare_combo)
+    f_replicate_script = f"{dir_replicate}.slim"
+    with open(f_scriptfile, 'r') as f:
+        replicate_script = f.read().replace(f"\"{os.path.join(dir_sub, 'slim_out')}\"", f"\"{dir_replicate}\"")
+    with open(f_replicate_script, 'w') as f:
+        f.write(replicate_script)
+    for attempt in range(1, args.retries + 2):
+        if os.path.isdir(dir_replicate): shutil.rmtree(dir_replicate)
+        os.makedirs(dir_replicate)
+        t = add_time(timings, "move outputs", start)
+        usage = run_slim(f_replicate_script, timeout = args.timeout, max_memory = args.max_memory, seed = seed)
+        start = add_time(timings, "slim", t)
+        append_manifest(f_manifest, sub_id, script_hash, "replicate", i, usage["exit_status"],
+                        f"{usage['seconds']:.3f}", f"{usage['user_seconds']:.3f}", f"{usage['sys_seconds']:.3f}",
+                        usage["max_rss_kb"], attempt, cache_status)
+        if usage["exit_status"] == 0:
+            break
+    success = usage["exit_status"] == 0
+    if success and cache_status == "miss":
+        result_cache.put(key, dir_replicate, {**usage, "seed": seed, "slim_version": slim_version})
+        start = add_time(timings, "cache", start)
+    if success:
+        collided = move_outputs(dir_replicate, dir_slimoutput)
+        if collided and cache_status == "miss":
+            result_cache.exclude(cache_hash)
+    shutil.rmtree(dir_replicate)
+    os.remove(f_replicate_script)
+    add_time(timings, "move outputs", start)
+    return (sub_id, i, success, False, timings, os.getpid())
+
+## zip outputs of a combination once all its replicates have been executed
+def finish_combo(result):
+    import shutil
+    sub_id = result["substitution_id"]
+    dir_sub = mk_run_prefix(dir_output, prefix, sub_id)
+    dir_work = mk_work_dir(dir_sub)
+    dir_slimoutput = os.path.join(dir_work, "slim_out")
+    timings = {}
+    result["finish_timings"] = timings
+    result["pid"] = os.getpid()
+    ## (added to database by the main process; see store_combo)
+    if store == "sqlite":
+        return result
+    t = time.perf_counter()
     ## zip stuff :)
     if zip_reps:
-        ## zip files (args: destination (without .zip extension), format, source
-        shutil.make_archive(base_name = dir_slimoutput, format = "zip", root_dir = dir_sub, base_dir = os.path.basename(dir_slimoutput))
+        ## zip files (args: destination, root directory, source (relative to root directory))
+        write_zip(f"{dir_slimoutput}.zip", dir_work, os.path.basename(dir_slimoutput))
         ## delete directory
         shutil.rmtree(dir_slimoutput)
+        t = add_time(timings, "zip", t)
     if to_zip:
-        ## zip files (args: destination (without .zip extension), format, source
-        shutil.make_archive(base_name = dir_sub, format = "zip", root_dir = dir_output, base_dir = os.path.basename(dir_sub))
-        ## delete directory
-        shutil.rmtree(dir_sub)
-    return 1
+        write_zip(f"{dir_sub}.zip", os.path.dirname(dir_work), os.path.basename(dir_work))
+        shutil.rmtree(dir_work)
+        t = add_time(timings, "zip", t)
+    elif dir_work != dir_sub:
+        ## move completed combination from scratch directory
+        if os.path.isdir(dir_sub): shutil.rmtree(dir_sub)
+        shutil.move(dir_work, dir_sub)
+        t = add_time(timings, "move from scratch", t)
+    append_manifest(f_manifest, sub_id, result["script_hash"], "complete", result["num_replicates"], 0)
+    return result
+
+## database of all combinations' files (--store sqlite); only the main process writes to it
+f_store = mkfname_store(dir_output, prefix, shard)
+output_store = None
+
+## add a finished combination to the database and delete its working directory (--store sqlite)
+def store_combo(result):
+    import shutil
+    global output_store
+    if output_store is None:
+        from output_store import OutputStore
+        output_store = OutputStore(f_store)
+    sub_id = result["substitution_id"]
+    dir_work = mk_work_dir(mk_run_prefix(dir_output, prefix, sub_id))
+    start = time.perf_counter()
+    output_store.add_combination(sub_id, dir_work, script_hash = result["script_hash"])
+    shutil.rmtree(dir_work)
+    tracker.record_timings("store", sub_id, None, {"store": time.perf_counter() - start}, os.getpid())
+    append_manifest(f_manifest, sub_id, result["script_hash"], "complete", result["num_replicates"], 0)
+    return result
+
+## make substitution files + their scripts and run and then zip each combo separately
+## (the combination is recorded as prepared before its replicates are executed)
+def parse_combo(substitution_file, timings = None):
+    result = prepare_combo(substitution_file, timings)
+    tracker.record_prepared(result)
+    if not result["resumed"]:
+        for i in result["replicates_todo"]:
+            if not tracker.record_replicate(run_replicate(result["substitution_id"], result["script_hash"], i,
+                                                          result["cache_hash"])):
+                result["failed"] = True
+        if result["failed"]:
+            return result
+        finish_combo(result)
+        tracker.record_timings("finish", result["substitution_id"], None, result["finish_timings"], result["pid"])
+        if store == "sqlite":
+            store_combo(result)
+    return result
+
+os.makedirs(dir_output, exist_ok = True)
+if dir_scratch is not None:
+    os.makedirs(dir_scratch, exist_ok = True)
+## fail before executing anything if the compression method is not available
+if to_zip or zip_reps:
+    try:
+        zip_settings()
+    except ValueError as e:
+        parser.error(str(e))
+
+## manifest, counters, timings (--profile, --timings-json) and progress metrics (--metrics) of this run
+## (starts a new manifest unless resuming)
+tracker = RunTracker(f_manifest, num_combos, prefix = prefix, resume = resume,
+                     f_dedup = mkfname_dedup(dir_output, prefix, shard) if dedup else None,
+                     canonical_ids = previous_canonical_ids,
+                     keep_task_timings = args.timings_json is not None)
+
+## give worker processes access to shared objects
+def init_worker(shared_profiled):
+    ## profile the first worker process to start (--profile-worker); its stats are written when it exits
+    if args.profile_worker is not None and shared_profiled.setdefault("pid", os.getpid()) == os.getpid():
+        import multiprocess as mp
+        start_profiler()
+        mp.util.Finalize(None, stop_profiler, exitpriority = 100)
+    return
+
+## cProfile.Profile of this process (--profile-worker)
+profiler = None
+
+def start_profiler():
+    global profiler
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return
+
+def stop_profiler():
+    profiler.disable()
+    profiler.dump_stats(args.profile_worker)
+    return
+
+## small chunks if there are few combinations per process, so that no process is left idle
+chunksize = args.chunksize if args.chunksize is not None else \
+    max(1, min(30, num_combos // (threads * 4)))
 
 ## import multiprocess only if threads > 1
 if threads > 1:
     import multiprocess as mp
-    with mp.Pool(processes = threads) as p:
-        list(tqdm.tqdm(p.imap(parse_combo, recipe_combos, chunksize = 30), total = recipe_file.num_combos()))
+    import tqdm
+    startup_times["import multiprocess, tqdm"] = time.perf_counter() - startup_start - sum(startup_times.values())
+    with mp.Manager() as manager:
+        shared_profiled = manager.dict() if args.profile_worker is not None else {}
+        with mp.Pool(processes = threads, initializer = init_worker,
+                     initargs = (shared_profiled,)) as p:
+            ## (started once the worker processes have been forked)
+            if args.metrics is not None:
+                tracker.start_metrics(args.metrics, args.metrics_interval)
+            with tqdm.tqdm(total = num_combos) as progress:
+                ## worker processes rebuild combinations from their substitution IDs (prepare_combo_id)
+                tracker.run_pool(p, progress, combo_ids, prepare_combo_id, run_replicate, finish_combo,
+                                 store = store_combo if store == "sqlite" else None, chunksize = chunksize)
+            ## let worker processes exit normally (instead of being terminated), so that --profile-worker
+            ## stats are written
+            p.close()
+            p.join()
 ## execute in sequence otherwise
 else:
+    if args.profile_worker is not None:
+        start_profiler()
+    if args.metrics is not None:
+        tracker.start_metrics(args.metrics, args.metrics_interval)
+    t = time.perf_counter()
     for substitution_file in recipe_combos:
-        _ = parse_combo(substitution_file)
+        tracker.record_started()
+        result = parse_combo(substitution_file, {"substitution file": time.perf_counter() - t})
+        tracker.record_finished(result["substitution_id"], failed = result["failed"])
+        t = time.perf_counter()
+    if args.profile_worker is not None:
+        stop_profiler()
+
+tracker.stop_metrics()
+tracker.close()
+if tracker.first_prepared_time is not None:
+    startup_times["build first script"] = tracker.first_prepared_time - startup_start - sum(startup_times.values())
+if output_store is not None:
+    output_store.close()
+## remove (empty) temporary scratch directory of --store sqlite
+if store == "sqlite" and args.dir_scratch is None and not os.listdir(dir_scratch):
+    os.rmdir(dir_scratch)
+if dedup:
+    print(f"Duplicate scripts: {tracker.num_duplicates} combination(s) not executed"
+          f" (see {mkfname_dedup(dir_output, prefix, shard)})")
+if result_cache is not None:
+    result_cache.evict()
+    print(f"Cache: {tracker.num_cache_hits} replicate(s) taken from {args.dir_cache},"
+          f" {tracker.num_cache_misses} replicate(s) executed")
+if resume:
+    print(f"Resumed: {tracker.num_resumed} combination(s) completed by a previous run were skipped")
+if tracker.tail_latency() is not None:
+    ## time taken by the slowest 5% of the run (i.e. from 95% to 100% of combinations completed)
+    tail_seconds, total_seconds = tracker.tail_latency()
+    print(f"Tail latency: {tail_seconds:.1f}s from 95% to 100% of combinations completed"
+          f" (total {total_seconds:.1f}s)")
+print(f"Module cache: {sum(hits for hits, misses in tracker.cache_stats.values())} hits,"
+      f" {sum(misses for hits, misses in tracker.cache_stats.values())} misses"
+      f" ({len(tracker.cache_stats)} process(es))")
+## wall time of each stage summed across all processes, and throughput (--profile, --timings-json)
+if args.profile:
+    tracker.print_profile(threads)
+if args.timings_json is not None:
+    tracker.write_timings_json(args.timings_json, threads)
+if args.profile_worker is not None:
+    print(f"Worker profile: {args.profile_worker}")
+if args.profile_startup:
+    print("Startup profile:")
+    for stage, seconds in startup_times.items():
+        print(f"  {stage:<30}{seconds * 1000:>10.1f} ms")
+    print(f"  {'total startup':<30}{sum(startup_times.values()) * 1000:>10.1f} ms")
+    print(f"  {'total':<30}{(time.perf_counter() - startup_start) * 1000:>10.1f} ms")
+failed_combos = tracker.failed_combos
+if failed_combos:
+    print(f"Failed: {len(failed_combos)} combination(s) had SLiM replicates that failed"
+          f" (see {f_manifest}); substitution ID(s):",
+          ', '.join([str(sub_id) for sub_id in sorted(failed_combos)[:20]])
+          + (", ..." if len(failed_combos) > 20 else ''))
+    sys.exit(1)
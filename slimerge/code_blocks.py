@@ -1,4 +1,14 @@
-import pyparsing as pp
+import os
+import re
+
+## pyparsing is only imported (and required) if Script.parser or RecipeFile.parser is set to
+## "pyparsing", or as a fallback for input with unbalanced curly braces
+def import_pyparsing():
+    try:
+        import pyparsing as pp
+    except ImportError:
+        return None
+    return pp
 
 ## adapted from https://stackoverflow.com/a/54715720
 def unlevel_list(obj):
@@ -10,6 +20,63 @@ def unlevel_list(obj):
         return obj
 
 
+## patterns equivalent to pyparsing's default whitespace and quotedString
+## (opening quote + pattern is matched greedily, then closing quote is required without backtracking)
+_re_whitespace = re.compile("[ \t\r\n]*")
+_re_quoted_body = {'"': re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'),
+                   "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*")}
+
+def scan_nested(string, re_token, fallback = None):
+    '''
+    Linear scanner that splits string into a nested list at curly braces.
+    Output is identical to pp.nestedExpr('{', '}', content = <tokens matching re_token>)
+    .searchString('{' + string + '}').asList(), i.e.
+    - leading whitespace of each token is skipped (trailing whitespace is retained)
+    - a quoted string directly following a brace is a separate token (braces within it are ignored)
+    - tabs are expanded to spaces (str.expandtabs)
+    If string has unbalanced braces, output of fallback(string) is returned if fallback is provided,
+    otherwise an Exception is raised.
+    '''
+    string = string.expandtabs()
+    stack = [[]]
+    pos = 0
+    end = len(string)
+    while True:
+        pos = _re_whitespace.match(string, pos).end()
+        if pos == end:
+            break
+        char = string[pos]
+        ## quoted strings (only checked after braces, as per pyparsing's ignoreExpr)
+        if char in _re_quoted_body:
+            match = _re_quoted_body[char].match(string, pos)
+            quote_end = match.end()
+            if quote_end < end and string[quote_end] == char:
+                stack[-1].append(string[pos:quote_end + 1])
+                pos = quote_end + 1
+                continue
+        if char == '{':
+            stack.append([])
+            pos += 1
+        elif char == '}':
+            if len(stack) == 1:
+                break
+            block = stack.pop()
+            stack[-1].append(block)
+            pos += 1
+        else:
+            ## consume tokens until the next brace
+            while True:
+                match = re_token.match(string, pos)
+                if match is None:
+                    break
+                stack[-1].append(match.group(0))
+                pos = _re_whitespace.match(string, match.end()).end()
+    if pos != end or len(stack) != 1:
+        if fallback is not None:
+            return fallback(string)
+        raise Exception("Unable to parse string with unbalanced curly braces.")
+    return [stack]
+
 def indentation(s):
     return (len(s) - len(s.lstrip()))
 
@@ -18,6 +85,10 @@ class CodeBlock:
     def __init__(self, raw_data):
         self.main = raw_data[0].strip()
         self.sub_blocks = []
+        ## {main: CodeBlock} for self.sub_blocks[:self._num_indexed] (see self.sub_block_index)
+        self._sub_block_index = {}
+        self._indexed_sub_blocks = self.sub_blocks
+        self._num_indexed = 0
         if len(raw_data) > 1:
             self.parse_sub_block(raw_data[1])
     def parse_sub_block(self, code_block):
@@ -65,30 +136,98 @@ class CodeBlock:
                     curr_indent + "}\n")
         else:
             return str_main + '\n'
+    def sub_block_index(self):
+        '''
+        Returns index of sub blocks ({main: CodeBlock}, where later sub blocks with the same main
+        take precedence). The index is kept between calls and only sub blocks added to
+        self.sub_blocks since the last call are indexed.
+        '''
+        sub_blocks = self.sub_blocks
+        ## rebuild if self.sub_blocks has been replaced or shortened
+        if self._indexed_sub_blocks is not sub_blocks or self._num_indexed > len(sub_blocks):
+            self._sub_block_index = {}
+            self._indexed_sub_blocks = sub_blocks
+            self._num_indexed = 0
+        sub_block_index = self._sub_block_index
+        for i in range(self._num_indexed, len(sub_blocks)):
+            sub_block_index[sub_blocks[i].main] = sub_blocks[i]
+        self._num_indexed = len(sub_blocks)
+        return sub_block_index
     def add_sub_blocks(self, new_sub_blocks):
         '''
         Integrate new sub-blocks (list of CodeBlock object) into script.
         CodeBlock objects in new_sub_blocks are assumed to be same level as 
         CodeBlock objects in self.sub_blocks.
+        New sub-blocks are only merged with sub-blocks that were present before this call
+        (i.e. duplicates within new_sub_blocks are retained).
         '''
         ## new_sub_blocks should be list of CodeBlock objects
         if len(new_sub_blocks) == 0:
             return
-        sub_block_index = {sub_block.main: sub_block for sub_block in self.sub_blocks}
+        sub_block_index = self.sub_block_index()
         for sub_block in new_sub_blocks:
-            sub_block_main = sub_block.main
-            if sub_block_main in sub_block_index:
-                sub_block_index[sub_block_main].add_sub_blocks(sub_block.sub_blocks)
+            existing_sub_block = sub_block_index.get(sub_block.main)
+            if existing_sub_block is not None:
+                existing_sub_block.add_sub_blocks(sub_block.sub_blocks)
             else:
                 self.sub_blocks.append(sub_block)
         return
+    def substituted(self, substitute_function, ignore_comments = True):
+        '''
+        Walk this code block (and its sub blocks) and return a list of new CodeBlock objects
+        with substitute_function (str -> str) applied to every line, without re-parsing.
+        Equivalent to re-parsing the substituted output of self.make_string, i.e.
+        - comment lines without sub blocks are dropped if ignore_comments = True
+        - lines that are blank after substitution are dropped
+        - resultant list is empty if this block is dropped
+        Returns None where re-parsing would have changed the block structure
+        (substituted line contains braces or newlines, or a line that opens a sub block is blank
+        or a comment), in which case the caller should fall back to make_string + re-parse.
+        '''
+        if ignore_comments and self.main[:2] == "//":
+            if not self.sub_blocks: return []
+            else: return None
+        main = substitute_function(self.main)
+        if '{' in main or '}' in main or '\n' in main or '\r' in main:
+            return None
+        main = main.strip()
+        if not main:
+            if not self.sub_blocks: return []
+            else: return None
+        new_block = CodeBlock([main])
+        for sub_block in self.sub_blocks:
+            new_sub_blocks = sub_block.substituted(substitute_function, ignore_comments = ignore_comments)
+            if new_sub_blocks is None: return None
+            new_block.sub_blocks.extend(new_sub_blocks)
+        return [new_block]
 
 class Script:
-    ## from https://stackoverflow.com/a/43443894
-    # single_line = pp.OneOrMore(pp.Word(pp.printables, excludeChars="{}").setWhitespaceChars(' ')).setParseAction(' '.join)
-    single_line = pp.OneOrMore(pp.Regex( "[^{}\\n]+" ))
-    multi_line = pp.OneOrMore(pp.Optional(single_line) + pp.LineEnd().suppress())
-    body = pp.nestedExpr( '{', '}', content = multi_line | single_line )
+    ## parser used by code_string_to_nested_list: "native" (scan_nested) or "pyparsing"
+    parser = "native"
+    line = re.compile("[^{}\\n]+")
+    _body = None
+    @classmethod
+    def pyparsing_body(cls):
+        '''
+        Returns pyparsing grammar for code blocks (built on first use),
+        or None if pyparsing is not installed.
+        '''
+        if cls._body is None:
+            pp = import_pyparsing()
+            if pp is None: return None
+            ## from https://stackoverflow.com/a/43443894
+            # single_line = pp.OneOrMore(pp.Word(pp.printables, excludeChars="{}").setWhitespaceChars(' ')).setParseAction(' '.join)
+            single_line = pp.OneOrMore(pp.Regex( "[^{}\\n]+" ))
+            multi_line = pp.OneOrMore(pp.Optional(single_line) + pp.LineEnd().suppress())
+            cls._body = pp.nestedExpr( '{', '}', content = multi_line | single_line )
+        return cls._body
+    @classmethod
+    def pyparsing_search(cls, string):
+        body = cls.pyparsing_body()
+        if body is None:
+            raise Exception(("pyparsing is required to parse this string"
+                             f" (unbalanced curly braces or {cls.__name__}.parser = 'pyparsing')."))
+        return body.searchString('{' + string + '}').asList()
     def code_string_to_nested_list(self, string):
         '''
         Parses string of code into nested list where each nested list is a nested code block.
@@ -102,10 +241,16 @@ class Script:
         becomes
           ['some_code;', '1 early()', ['sim.addSubpop("p1", 500);']]
         '''
-        return unlevel_list(self.body.searchString('{' + string + '}').asList())
+        if self.parser == "pyparsing":
+            return unlevel_list(self.pyparsing_search(string))
+        return unlevel_list(scan_nested(string, self.line, fallback = self.pyparsing_search))
     def __init__(self, filename = None, string = None, indentation = '\t', suppress_warning = False):
         self.indentation = indentation
         self.code_blocks = []
+        ## {main: CodeBlock} for self.code_blocks[:self._num_indexed] (see self.block_index)
+        self._block_index = {}
+        self._indexed_blocks = self.code_blocks
+        self._num_indexed = 0
         if filename is not None:
             self.parse_file(filename)
         elif string is not None:
@@ -158,17 +303,47 @@ class Script:
         new_script.indentation = self.indentation
         new_script.substitution_block = self.substitution_block
         return new_script
+    def substituted(self, substitute_function, ignore_comments = True):
+        '''
+        Create a new Script object by applying substitute_function (str -> str) to every line of
+        self's CodeBlock tree (see CodeBlock.substituted) instead of re-parsing the output of
+        self.make_string.
+        Returns None if the substitution would change the block structure.
+        '''
+        new_script = self.__class__(indentation = self.indentation, suppress_warning = True)
+        for code_block in self.code_blocks:
+            new_code_blocks = code_block.substituted(substitute_function, ignore_comments = ignore_comments)
+            if new_code_blocks is None: return None
+            new_script.code_blocks.extend(new_code_blocks)
+        return new_script
+    def block_index(self):
+        '''
+        Returns index of top-level code blocks ({main: CodeBlock}, where earlier code blocks with
+        the same main take precedence). The index is kept between calls and only code blocks added
+        to self.code_blocks since the last call are indexed.
+        '''
+        code_blocks = self.code_blocks
+        ## rebuild if self.code_blocks has been replaced or shortened
+        if self._indexed_blocks is not code_blocks or self._num_indexed > len(code_blocks):
+            self._block_index = {}
+            self._indexed_blocks = code_blocks
+            self._num_indexed = 0
+        block_index = self._block_index
+        for i in range(self._num_indexed, len(code_blocks)):
+            block_index.setdefault(code_blocks[i].main, code_blocks[i])
+        self._num_indexed = len(code_blocks)
+        return block_index
     def merge_block(self, new_code_block):
         '''
         Integrate new CodeBlock object (new_code_block) into script.
         New CodeBlock object is assumed to be top-level.
         '''
         ## new_code_block should be a CodeBlock object
-        for code_block in self.code_blocks:
-            ## if new code block's opening matches any top level opening in the script, merge and exit
-            if code_block.main == new_code_block.main:
-                code_block.add_sub_blocks(new_code_block.sub_blocks)
-                return
+        ## if new code block's opening matches any top level opening in the script, merge and exit
+        code_block = self.block_index().get(new_code_block.main)
+        if code_block is not None:
+            code_block.add_sub_blocks(new_code_block.sub_blocks)
+            return
         ## if no matches found, append code block to script
         self.code_blocks.append(new_code_block)
         return
@@ -201,16 +376,67 @@ class ScriptModule(Script):
         if substitute and sub_block is not None:
             return sub_block.substitute(output)
         return output
-    def copy(self, *args, **kwargs):
+    def copy(self, ignore_comments = True, substitute = True, substitution_block = None, reparse = False):
         '''
-        Uses output of self.make_string to create a completely new Script object.
+        Creates a completely new Script object.
         If substitute = True and self.substitution_block is not None, variable values from
-        self.substitution_block will be substituted in output of self.make_string before
-        creating the new object.
-        Arguments (for self.make_string): ignore_comments=T, substitute=T
-        (created a child method just so I can update the docs with new argument)
+        self.substitution_block will be substituted into the new object.
+        If substitution_block is not None, it will be used instead of self.substitution_block.
+        Substitution is applied directly to the CodeBlock tree (see Script.substituted).
+        If reparse = True, or if a substituted value would change the block structure
+        (e.g. it contains braces), the output of self.make_string is re-parsed instead.
+        '''
+        sub_block = substitution_block if substitution_block is not None else self.substitution_block
+        if not reparse:
+            if substitute and sub_block is not None:
+                new_script = self.substituted(sub_block.substitute, ignore_comments = ignore_comments)
+            else:
+                new_script = self.substituted(lambda line: line, ignore_comments = ignore_comments)
+            if new_script is not None:
+                new_script.substitution_block = self.substitution_block
+                return new_script
+        return super().copy(ignore_comments = ignore_comments, substitute = substitute,
+                            substitution_block = substitution_block)
+
+class ModuleCache:
+    '''
+    Process-wide cache of parsed module files, keyed by path plus file mtime and size so that
+    edited modules are re-parsed. Cached ScriptModule objects are shared and should be treated
+    as read-only (SubstitutionFile.build_script only ever uses them via ScriptModule.copy).
+    Worker processes each hold their own cache (populated on first use in that process).
+    '''
+    def __init__(self):
+        self.modules = {}
+        self.hits = 0
+        self.misses = 0
+    def key(self, filename):
+        stat = os.stat(filename)
+        return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    def get(self, filename):
+        '''
+        Returns parsed ScriptModule for filename, parsing the file only if it is not yet cached
+        (or has changed on disk since it was cached).
         '''
-        return super().copy(*args, **kwargs)
+        key = self.key(filename)
+        if key in self.modules:
+            self.hits += 1
+        else:
+            self.misses += 1
+            ## drop stale entries for the same path
+            for old_key in [k for k in self.modules if k[0] == key[0]]:
+                del self.modules[old_key]
+            self.modules[key] = ScriptModule(filename = filename)
+        return self.modules[key]
+    def clear(self):
+        self.modules = {}
+        self.hits = 0
+        self.misses = 0
+        return
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "modules": len(self.modules)}
+
+## shared by all SubstitutionFile objects in this process
+module_cache = ModuleCache()
 
 
 # class ScriptSubstitution(Script):
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+
+class OutputStore:
+    '''
+    Single SQLite database holding the files of many combinations (e.g. <prefix>_1/<prefix>_1.txt,
+    <prefix>_1/<prefix>_1.slim and <prefix>_1/slim_out/*), instead of one directory or zip file
+    per combination. Files are stored under the same relative paths as in a zip file of the
+    combination's directory, so that OutputStore.extract recreates that directory.
+    Each combination is written in a single transaction; other processes writing to the same
+    database wait (up to 'timeout' seconds) for the transaction to finish.
+    '''
+    def __init__(self, filename, timeout = 600):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, timeout = timeout)
+        with self.connection:
+            self.connection.execute(("CREATE TABLE IF NOT EXISTS combinations"
+                                     " (substitution_id INTEGER PRIMARY KEY, name TEXT, script_hash TEXT)"))
+            self.connection.execute(("CREATE TABLE IF NOT EXISTS files"
+                                     " (substitution_id INTEGER, path TEXT, data BLOB,"
+                                     " PRIMARY KEY (substitution_id, path))"))
+        return
+    def close(self):
+        self.connection.close()
+        return
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
+        return
+    ## store all files in dir_path (replacing previously stored files of the same combination)
+    def add_combination(self, substitution_id, dir_path, script_hash = None):
+        dir_root = os.path.dirname(dir_path)
+        with self.connection:
+            self.connection.execute("DELETE FROM files WHERE substitution_id = ?", (substitution_id,))
+            self.connection.execute("INSERT OR REPLACE INTO combinations VALUES (?, ?, ?)",
+                                    (substitution_id, os.path.basename(dir_path), script_hash))
+            for root, dirs, files in os.walk(dir_path):
+                dirs.sort()
+                for fname in sorted(files):
+                    with open(os.path.join(root, fname), "rb") as f:
+                        self.connection.execute("INSERT INTO files VALUES (?, ?, ?)",
+                                                (substitution_id,
+                                                 os.path.relpath(os.path.join(root, fname), dir_root),
+                                                 f.read()))
+        return
+    ## copy combinations (and their files) from another OutputStore database, e.g. of another shard
+    def merge(self, filename):
+        self.connection.execute("ATTACH DATABASE ? AS other", (filename,))
+        try:
+            with self.connection:
+                self.connection.execute(("DELETE FROM files WHERE substitution_id IN"
+                                         " (SELECT substitution_id FROM other.combinations)"))
+                self.connection.execute("INSERT OR REPLACE INTO combinations SELECT * FROM other.combinations")
+                self.connection.execute("INSERT INTO files SELECT * FROM other.files")
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+        return
+    def substitution_ids(self):
+        return [row[0] for row in
+                self.connection.execute("SELECT substitution_id FROM combinations ORDER BY substitution_id")]
+    def __contains__(self, substitution_id):
+        return self.connection.execute("SELECT 1 FROM combinations WHERE substitution_id = ?",
+                                       (substitution_id,)).fetchone() is not None
+    ## name of combination's directory (e.g. <prefix>_<substitution_id>)
+    def name(self, substitution_id):
+        row = self.connection.execute("SELECT name FROM combinations WHERE substitution_id = ?",
+                                      (substitution_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Substitution ID {substitution_id} is not in {self.filename}.")
+        return row[0]
+    ## relative paths of all files of a combination
+    def files(self, substitution_id):
+        return [row[0] for row in
+                self.connection.execute("SELECT path FROM files WHERE substitution_id = ? ORDER BY path",
+                                        (substitution_id,))]
+    def read(self, substitution_id, path):
+        row = self.connection.execute("SELECT data FROM files WHERE substitution_id = ? AND path = ?",
+                                      (substitution_id, path)).fetchone()
+        if row is None:
+            raise KeyError(f"{path} of substitution ID {substitution_id} is not in {self.filename}.")
+        return row[0]
+    ## contents of the combination's substitution file (<name>/<name>.txt)
+    def substitution_string(self, substitution_id):
+        name = self.name(substitution_id)
+        return self.read(substitution_id, f"{name}/{name}.txt").decode()
+    ## write all files of a combination to dir_dest (i.e. to dir_dest/<name>/...)
+    def extract(self, substitution_id, dir_dest):
+        for path, data in self.connection.execute("SELECT path, data FROM files WHERE substitution_id = ?",
+                                                  (substitution_id,)):
+            fname = os.path.join(dir_dest, path)
+            os.makedirs(os.path.dirname(fname), exist_ok = True)
+            with open(fname, "wb") as f:
+                f.write(data)
+        return os.path.join(dir_dest, self.name(substitution_id))
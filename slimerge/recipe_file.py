@@ -1,11 +1,11 @@
+import re
 import copy
+import math
 import itertools
-import numpy
 import warnings
-import pyparsing as pp
 
 from substitution_file import SubstitutionBlockSubFile, SubstitutionFile, SubstitutionParser
-from code_blocks import unlevel_list
+from code_blocks import unlevel_list, scan_nested, import_pyparsing
 
 ## alternative blocks are contiguous elements which are lists separated by '|'
 ## only parses top-level
@@ -78,23 +78,32 @@ class CachedIter():
             yield from self.cache
         return
 
+## cartesian product (as tuples, with the last iterable varying fastest) where only the first iterable
+## is consumed lazily; the others are iterated once (after the first element of the first iterable
+## is available) and cached, so the first iterable may be a generator of arbitrary length
 def product_cached(*args):
-    if args:
-        new_args = [args[0]] + [CachedIter(arg) for arg in args[1:]]
-    else:
-        return []
-    def product(*args):
-        if len(args) == 1:
-            for i in args[0]:
-                yield [i]
-        else:
-            for i in args[0]:
-                for j in product(*args[1:]):
-                    yield [i] + j
+    if not args:
         return
-    yield from product(*new_args)
+    cached = None
+    for i in args[0]:
+        if cached is None:
+            cached = [tuple(arg) for arg in args[1:]]
+            if not all(cached): return
+        for j in itertools.product(*cached):
+            yield (i,) + j
     return
 
+## a combination is a tuple of (RecipeBlock, tuple of values of RecipeBlock.variables) pairs,
+## which only holds references to the recipe's blocks and values;
+## SubstitutionFile objects are created from combinations only when requested
+def make_substitution_file(combination, substitution_id, overwrite_earlier = True):
+    output = SubstitutionFile(suppress_warning = True)
+    for recipe_block, values in combination:
+        output.add_substitution_block(recipe_block.make_substitution_block(values, output),
+                                      overwrite = overwrite_earlier)
+    output.substitution_id = substitution_id
+    return output
+
 # def test_gen():
 #     while True:
 #         yield 1
@@ -140,18 +149,35 @@ class RecipeBlockMulti():
         self.blocks.append(new_recipe_block)
         return
     ## just well count the number of combinations
+    ## (exact integer; no combinations are generated if there are no blocks)
     def num_combos(self):
-        return numpy.prod([block.num_combos() for block in self.blocks])
+        if not self.blocks: return 0
+        return math.prod([block.num_combos() for block in self.blocks])
+    ## generator of every possible combination (see make_substitution_file) of blocks and values
+    def combinations(self):
+        combos = product_cached(*[block.combinations() for block in self.blocks if block is not None])
+        for combo in combos:
+            yield tuple(itertools.chain.from_iterable(combo))
+        return
+    ## index-th (0-based) combination of self.combinations,
+    ## decoded as a mixed-radix number where the last block varies fastest
+    def combination(self, index):
+        blocks = [block for block in self.blocks if block is not None]
+        combo = []
+        remainder = index
+        for block in reversed(blocks):
+            remainder, block_index = divmod(remainder, block.num_combos())
+            combo.append(block.combination(block_index))
+        combo.reverse()
+        return tuple(itertools.chain.from_iterable(combo))
     ## generator of SubstitutionFile objects with every possible combination of blocks and values
     def substitution_combos(self, overwrite_earlier = True):
-        combos = product_cached(*[block.substitution_combos() for block in self.blocks if block is not None])
-        for i, combo in enumerate(combos):
-            output = SubstitutionFile(suppress_warning = True)
-            for sub_file in combo:
-                output.merge(sub_file, overwrite = overwrite_earlier, deepcopy = True)
-            output.substitution_id = i+1
-            yield output
+        for i, combo in enumerate(self.combinations()):
+            yield make_substitution_file(combo, i+1, overwrite_earlier = overwrite_earlier)
         return
+    ## SubstitutionFile object for the index-th (0-based) combination of self.substitution_combos
+    def substitution_combo(self, index, overwrite_earlier = True):
+        return make_substitution_file(self.combination(index), index+1, overwrite_earlier = overwrite_earlier)
     def print_recipe(self, indentation = ''):
         for block in self.blocks:
             block.print_recipe(indentation = indentation)
@@ -184,23 +210,43 @@ class RecipeBlock(SubstitutionBlockSubFile):
         return
     ## count number of possible combinations
     def num_combos(self):
-        return numpy.prod([len(values) for values in self.variables.values()])
-    ## generator of SubstitutionFile objects with every possible combination of values
-    def substitution_combos(self):
+        return math.prod([len(values) for values in self.variables.values()])
+    ## generator of every possible combination (see make_substitution_file) of values
+    def combinations(self):
         variables = list(self.variables.keys())
         if variables:
             combos = product_cached(*[self.variables[var] for var in variables])
         else:
             combos = [[]]
-        for i, combo in enumerate(combos):
-            output_sub_file = SubstitutionFile(suppress_warning = True)
-            str_header = self.generate_str_header()
-            str_variables = [f"{variables[i]}={combo[i]}" for i in range(len(variables))]
-            sub_block = SubstitutionBlockSubFile([str_header] + str_variables, output_sub_file)
-            output_sub_file.add_substitution_block(sub_block)
-            output_sub_file.substitution_id = i+1
-            yield output_sub_file
+        for combo in combos:
+            yield ((self, tuple(combo)),)
         return
+    ## index-th (0-based) combination of self.combinations,
+    ## decoded as a mixed-radix number where the last variable varies fastest
+    def combination(self, index):
+        combo = []
+        remainder = index
+        for values in reversed(list(self.variables.values())):
+            remainder, value_index = divmod(remainder, len(values))
+            combo.append(values[value_index])
+        combo.reverse()
+        return ((self, tuple(combo)),)
+    ## generator of SubstitutionFile objects with every possible combination of values
+    def substitution_combos(self):
+        for i, combo in enumerate(self.combinations()):
+            yield make_substitution_file(combo, i+1)
+        return
+    ## SubstitutionFile object for the index-th (0-based) combination of self.substitution_combos
+    def substitution_combo(self, index):
+        return make_substitution_file(self.combination(index), index+1)
+    ## SubstitutionBlockSubFile for this module (belonging to sub_file) with variables set to values
+    def make_substitution_block(self, values, sub_file):
+        sub_block = SubstitutionBlockSubFile([self.generate_str_header()], sub_file)
+        for name, value in zip(self.variables, values):
+            ## default values are retrieved as in SubstitutionBlockSubFile.parse_variable
+            if value == '.': value = sub_file.defaults(self.filename).get(name, '')
+            sub_block.add_variable(name, value)
+        return sub_block
     ## generate variables as string that can be written to a recipe file (will be used by self.generate_string)
     def generate_str_variables(self):
         return '\n'.join([f"{varname}={';'.join(values)}" for varname, values in self.variables.items()])
@@ -231,16 +277,29 @@ class RecipeBlockAlt():
         for recipe in self.recipes:
             output += recipe.num_combos()
         return output
+    ## generator of every possible combination (see make_substitution_file) of blocks and values
+    ## (alternative blocks are enumerated one after another)
+    def combinations(self):
+        for recipe in self.recipes:
+            yield from recipe.combinations()
+        return
+    ## index-th (0-based) combination of self.combinations
+    def combination(self, index):
+        offset = 0
+        for recipe in self.recipes:
+            num_combos = recipe.num_combos()
+            if index - offset < num_combos:
+                return recipe.combination(index - offset)
+            offset += num_combos
+        raise IndexError(f"Combination index {index} is out of range.")
     ## generator of SubstitutionFile objects with every possible combination of blocks and values
     def substitution_combos(self, overwrite_earlier = True):
-        i = 0
-        for recipe in self.recipes:
-            combos = recipe.substitution_combos(overwrite_earlier = overwrite_earlier)
-            for sub_file in combos:
-                sub_file.substitution_id = i+1
-                i += 1
-                yield sub_file
+        for i, combo in enumerate(self.combinations()):
+            yield make_substitution_file(combo, i+1, overwrite_earlier = overwrite_earlier)
         return
+    ## SubstitutionFile object for the index-th (0-based) combination of self.substitution_combos
+    def substitution_combo(self, index, overwrite_earlier = True):
+        return make_substitution_file(self.combination(index), index+1, overwrite_earlier = overwrite_earlier)
     def print_recipe(self, indentation = ''):
         new_indentation = indentation + "  "
         print(indentation + '{')
@@ -254,8 +313,29 @@ class RecipeBlockAlt():
 
 class RecipeFile(SubstitutionFile):
     ## differs from SubstitutionBlockGen in that variable values are list of possible values, not a single value
-    multi_line = pp.OneOrMore(pp.Regex( "[^{}]+" ))
-    body = pp.nestedExpr( '{', '}', content = multi_line )
+    ## parser used by recipe_to_blocks: "native" (scan_nested) or "pyparsing"
+    parser = "native"
+    lines = re.compile("[^{}]+")
+    _body = None
+    @classmethod
+    def pyparsing_body(cls):
+        '''
+        Returns pyparsing grammar for recipe blocks (built on first use),
+        or None if pyparsing is not installed.
+        '''
+        if cls._body is None:
+            pp = import_pyparsing()
+            if pp is None: return None
+            multi_line = pp.OneOrMore(pp.Regex( "[^{}]+" ))
+            cls._body = pp.nestedExpr( '{', '}', content = multi_line )
+        return cls._body
+    @classmethod
+    def pyparsing_search(cls, string):
+        body = cls.pyparsing_body()
+        if body is None:
+            raise Exception(("pyparsing is required to parse this string"
+                             f" (unbalanced curly braces or {cls.__name__}.parser = 'pyparsing')."))
+        return body.searchString('{' + string + '}').asList()
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
     def recipe_to_blocks(self, string):
@@ -284,7 +364,9 @@ class RecipeFile(SubstitutionFile):
           ['[general.slim]\nVAR1=1\n', ['[module1.slim]\n  VAR2=3\n  [module2.slim]\n  VAR3=2\n'], '|', ['[module3.slim]\n  VAR4=0\n  ', ['[module1.slim]\n    VAR2=3\n  '], '|', ['[module2.slim]\n    VAR3=2\n  ']]]
           (note retained whitespace characters and '|')
         '''
-        return unlevel_list(self.body.searchString('{' + string + '}').asList())
+        if self.parser == "pyparsing":
+            return unlevel_list(self.pyparsing_search(string))
+        return unlevel_list(scan_nested(string, self.lines, fallback = self.pyparsing_search))
     def parse(self, filename = None, string = None):
         if filename is not None: self.parse_file(filename)
         elif string is not None: self.parse_string(string)
@@ -297,17 +379,51 @@ class RecipeFile(SubstitutionFile):
         self.recipe = RecipeBlockMulti(group_alt_blocks(self.recipe_to_blocks(string)), self)
     def num_combos(self):
         return self.recipe.num_combos()
-    def substitution_files(self):
-        ## generate all possible SubstitutionFile objects with
-        ## all possible combination of values and modules according to recipe file
+    def substitution_files(self, substitution_ids = None):
+        '''
+        Generate all possible SubstitutionFile objects with
+        all possible combination of values and modules according to recipe file.
+        If substitution_ids (iterable of int) is provided, only SubstitutionFile objects for those
+        substitution IDs are generated (see self.substitution_file), e.g.
+        substitution_ids = range(1001, 2001) or range(1, self.num_combos() + 1)[k::n].
+        '''
+        if substitution_ids is not None:
+            for substitution_id in substitution_ids:
+                yield self.substitution_file(substitution_id)
+            return
         sub_files = self.recipe.substitution_combos()
         for i, sub_file in enumerate(sub_files):
             sub_file.substitution_id = i+1
-            sub_file.modules_d = self.modules_d
-            sub_file.module_paths = self.module_paths
-            sub_file._defaults = self._defaults
+            self._share_modules(sub_file)
             yield sub_file
         return 
+    def combinations(self):
+        '''
+        Generate all possible combinations of values and modules according to recipe file
+        as tuples of (RecipeBlock, tuple of values) pairs, in the same order as self.substitution_files().
+        Use make_substitution_file(combination, substitution_id) to create a SubstitutionFile object.
+        '''
+        return self.recipe.combinations()
+    def substitution_file(self, substitution_id):
+        '''
+        Returns the SubstitutionFile object with the given substitution ID (1-based; negative values
+        count from the last combination) without generating any other combination.
+        Identical to the object with the same ID generated by self.substitution_files().
+        '''
+        num_combos = self.num_combos()
+        index = substitution_id - 1 if substitution_id > 0 else num_combos + substitution_id
+        if not (0 <= index < num_combos) or substitution_id == 0:
+            raise IndexError(f"Substitution ID {substitution_id} is out of range (1-{num_combos}).")
+        sub_file = self.recipe.substitution_combo(index)
+        sub_file.substitution_id = index+1
+        self._share_modules(sub_file)
+        return sub_file
+    ## share module paths and cached defaults with SubstitutionFile generated from this recipe
+    def _share_modules(self, sub_file):
+        sub_file.modules_d = self.modules_d
+        sub_file.module_paths = self.module_paths
+        sub_file._defaults = self._defaults
+        return
     def slim_files(self):
         ## generate all possible slim files with
         ## all possible combination of values and modules according to recipe file
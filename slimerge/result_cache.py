@@ -0,0 +1,149 @@
+import os
+import json
+import shutil
+import hashlib
+
+class ResultCache:
+    '''
+    Content-addressed cache of the output files of SLiM replicates, shared between runs (and sweeps).
+    Each entry is keyed by the SHA-256 of (script hash, seed, SLiM version) and stored as
+    <dir_cache>/<key[:2]>/<key>/files/... plus <key>/usage.json (resource usage of the original execution).
+    Entries are added atomically (written to a temporary directory, then renamed), so that
+    processes sharing the cache never see a partially written entry. Files are copied into and out of
+    the cache (and stored read-only), so that modifying output files never modifies cached files.
+    Scripts marked with exclude (e.g. as their replicates write files with the same name, so that a
+    replicate's outputs depend on the others') are neither looked up nor added.
+    If max_size (bytes) is set, least recently used entries (by mtime of the entry directory,
+    which is updated on every hit) are evicted once the cache grows larger than max_size.
+    '''
+    def __init__(self, dir_cache, max_size = None):
+        self.dir_cache = dir_cache
+        self.max_size = max_size
+        ## bytes added by this process since the last eviction
+        self.added = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(dir_cache, exist_ok = True)
+        return
+    @staticmethod
+    def key(script_hash, seed, slim_version):
+        return hashlib.sha256(f"{script_hash}\t{seed}\t{slim_version}".encode()).hexdigest()
+    def entry_dir(self, key):
+        return os.path.join(self.dir_cache, key[:2], key)
+    def exclusion_file(self, script_hash):
+        return os.path.join(self.dir_cache, "excluded", script_hash)
+    ## stop caching outputs of script_hash (in all processes and runs sharing the cache)
+    def exclude(self, script_hash):
+        os.makedirs(os.path.dirname(self.exclusion_file(script_hash)), exist_ok = True)
+        with open(self.exclusion_file(script_hash), 'w'):
+            pass
+        return
+    def excluded(self, script_hash):
+        return os.path.exists(self.exclusion_file(script_hash))
+    def get(self, key, dir_dest):
+        '''
+        Copies the cached files of key into dir_dest (which should be empty) and returns the cached
+        resource usage, or returns None if key is not cached.
+        '''
+        dir_entry = self.entry_dir(key)
+        dir_files = os.path.join(dir_entry, "files")
+        copied = []
+        try:
+            with open(os.path.join(dir_entry, "usage.json"), 'r') as f:
+                usage = json.load(f)
+            for root, dirs, files in os.walk(dir_files):
+                dir_root = os.path.join(dir_dest, os.path.relpath(root, dir_files))
+                os.makedirs(dir_root, exist_ok = True)
+                for fname in sorted(files):
+                    dest = os.path.join(dir_root, fname)
+                    ## (copies contents only, i.e. dest is not read-only)
+                    shutil.copyfile(os.path.join(root, fname), dest)
+                    copied.append(dest)
+            ## (os.walk does not raise if dir_files does not exist)
+            if not os.path.isdir(dir_files):
+                raise FileNotFoundError(dir_files)
+            ## mark as recently used
+            os.utime(dir_entry)
+        except FileNotFoundError:
+            ## not cached (or evicted by another process while being read)
+            for dest in copied:
+                if os.path.exists(dest): os.remove(dest)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return usage
+    def put(self, key, dir_src, usage):
+        '''
+        Adds all files in dir_src (including subdirectories) and usage (dict) as entry key,
+        unless already cached.
+        '''
+        dir_entry = self.entry_dir(key)
+        if os.path.isdir(dir_entry):
+            return
+        dir_tmp = f"{dir_entry}.{os.getpid()}.part"
+        os.makedirs(os.path.join(dir_tmp, "files"), exist_ok = True)
+        for root, dirs, files in os.walk(dir_src):
+            dir_root = os.path.join(dir_tmp, "files", os.path.relpath(root, dir_src))
+            os.makedirs(dir_root, exist_ok = True)
+            for fname in files:
+                shutil.copyfile(os.path.join(root, fname), os.path.join(dir_root, fname))
+                os.chmod(os.path.join(dir_root, fname), 0o444)
+                self.added += os.path.getsize(os.path.join(root, fname))
+        with open(os.path.join(dir_tmp, "usage.json"), 'w') as f:
+            json.dump(usage, f)
+        try:
+            os.rename(dir_tmp, dir_entry)
+        except OSError:
+            ## added by another process in the meantime
+            shutil.rmtree(dir_tmp)
+        ## (evict once this process has added a tenth of the maximum size, so that the cache
+        ##  is not scanned after every entry)
+        if self.max_size is not None and self.added > self.max_size // 10:
+            self.evict()
+        return
+    def entries(self):
+        '''
+        Returns list of (last used time, size in bytes, entry directory) of all complete entries.
+        '''
+        entries = []
+        for prefix in os.listdir(self.dir_cache):
+            dir_prefix = os.path.join(self.dir_cache, prefix)
+            ## (entries are in directories named after the first 2 characters of their key)
+            if len(prefix) != 2 or not os.path.isdir(dir_prefix): continue
+            for key in os.listdir(dir_prefix):
+                dir_entry = os.path.join(dir_prefix, key)
+                if key.endswith(".part"): continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(root, fname))
+                               for root, dirs, files in os.walk(os.path.join(dir_entry, "files"))
+                               for fname in files)
+                    entries.append((os.stat(dir_entry).st_mtime, size, dir_entry))
+                except FileNotFoundError:
+                    continue
+        return entries
+    def size(self):
+        return sum(size for mtime, size, dir_entry in self.entries())
+    def evict(self, max_size = None):
+        '''
+        Removes least recently used entries until the cache is no larger than max_size
+        (default: self.max_size). Returns number of entries removed.
+        '''
+        max_size = self.max_size if max_size is None else max_size
+        self.added = 0
+        if max_size is None:
+            return 0
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, dir_entry in entries)
+        num_removed = 0
+        for mtime, size, dir_entry in entries:
+            if total <= max_size: break
+            ## rename first so that the entry disappears at once for other processes
+            dir_tmp = f"{dir_entry}.{os.getpid()}.evicted.part"
+            try:
+                os.rename(dir_entry, dir_tmp)
+            except OSError:
+                continue
+            shutil.rmtree(dir_tmp, ignore_errors = True)
+            total -= size
+            num_removed += 1
+        return num_removed
@@ -0,0 +1,354 @@
+import os
+import time
+
+## EVENT is 'replicate' (REPLICATE is replicate number) or
+## 'complete' (all replicates done and zipped; REPLICATE is number of replicates)
+## (EXIT_STATUS is "timeout" for replicates killed by --timeout; there is one row per attempt (--retries);
+##  MAX_RSS_KB is the maximum resident set size of the SLiM process;
+##  CACHE is 'hit' if outputs were taken from --cache-dir instead of executing SLiM, 'miss' otherwise,
+##  or 'excluded' if the script's outputs are not cached)
+manifest_columns = ["SUBSTITUTION_ID", "SCRIPT_SHA256", "EVENT", "REPLICATE", "EXIT_STATUS", "SECONDS",
+                    "USER_SECONDS", "SYS_SECONDS", "MAX_RSS_KB", "ATTEMPT", "CACHE"]
+
+## columns of the manifest of duplicate scripts (--dedup)
+dedup_columns = ["SUBSTITUTION_ID", "CANONICAL_ID", "SCRIPT_SHA256"]
+
+## append a row to the manifest in a single write to a file opened with O_APPEND,
+## so that rows written by different worker processes are not interleaved
+def append_manifest(fname, *row):
+    fd = os.open(fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, ('\t'.join([str(e) for e in row]) + '\n').encode())
+    finally:
+        os.close(fd)
+    return
+
+## parse manifest into {substitution ID: {"script_hash": <hash>, "replicates": <set of successful
+## replicate numbers>, "complete": <bool>, "seconds": <list of seconds of successful replicates>}};
+## later rows with a different hash reset earlier ones
+def read_manifest(fname):
+    previous_runs = {}
+    if not os.path.exists(fname):
+        return previous_runs
+    with open(fname, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            ## (manifests written by older versions have fewer columns)
+            if len(row) < 5 or row[0] == manifest_columns[0]:
+                continue
+            sub_id, script_hash, event, replicate, exit_status = row[:5]
+            sub_id = int(sub_id)
+            if sub_id not in previous_runs or previous_runs[sub_id]["script_hash"] != script_hash:
+                previous_runs[sub_id] = {"script_hash": script_hash, "replicates": set(), "complete": False,
+                                         "seconds": []}
+            if event == "replicate" and exit_status == '0':
+                previous_runs[sub_id]["replicates"].add(int(replicate))
+                if len(row) > 5 and row[5]:
+                    previous_runs[sub_id]["seconds"].append(float(row[5]))
+            elif event == "complete":
+                previous_runs[sub_id]["complete"] = True
+    return previous_runs
+
+## parse manifest of duplicate scripts into {script hash: substitution ID of the combination executed
+## in place of all combinations with that script}
+def read_dedup(fname):
+    canonical_ids = {}
+    if not os.path.exists(fname):
+        return canonical_ids
+    with open(fname, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) < 3 or row[0] == dedup_columns[0]:
+                continue
+            canonical_ids[row[2]] = int(row[1])
+    return canonical_ids
+
+class RunTracker:
+    '''
+    Bookkeeping of a run of num_combos combinations in the main process: the manifest (f_manifest;
+    a new one is started unless resuming), the manifest of duplicate scripts (f_dedup, if not None;
+    see record_prepared), counters of combinations and replicates, the wall time of each stage of
+    each task (see record_timings) and progress metrics, which can be written periodically by a background thread
+    (see start_metrics). Worker processes only append rows to the manifest (append_manifest);
+    the results of their tasks are recorded by the main process (record_prepared, record_replicate,
+    record_finished), either directly or via run_pool.
+    '''
+    def __init__(self, f_manifest, num_combos, prefix = '', resume = False, f_dedup = None,
+                 canonical_ids = None, keep_task_timings = False):
+        self.f_manifest = f_manifest
+        self.num_combos = num_combos
+        self.prefix = prefix
+        self.keep_task_timings = keep_task_timings
+        ## latest module cache counts for each process, indexed by pid
+        self.cache_stats = {}
+        ## number of combinations skipped as duplicates (--dedup)
+        self.num_duplicates = 0
+        ## {script hash: substitution ID of the combination executed for that script} (--dedup),
+        ## starting from canonical_ids (e.g. those of a previous run, see read_dedup)
+        self.canonical_ids = {} if canonical_ids is None else dict(canonical_ids)
+        ## number of combinations skipped as they were completed by a previous run (--resume)
+        self.num_resumed = 0
+        ## number of replicates whose outputs were taken from the cache / executed (--cache-dir)
+        self.num_cache_hits = 0
+        self.num_cache_misses = 0
+        ## number of combinations whose preparation has completed (or, in sequence, started)
+        self.num_started = 0
+        ## substitution IDs of combinations with replicates that failed (even after --retries)
+        self.failed_combos = []
+        ## {stage: [number of tasks, total seconds, maximum seconds]} across all processes
+        self.stage_timings = {}
+        ## {"task", "substitution_id", "replicate", "pid", "seconds": {stage: seconds}} of each task
+        ## (if keep_task_timings)
+        self.task_timings = []
+        ## {pid: total seconds of timed stages of tasks executed by that process}
+        self.busy_seconds = {}
+        ## time (since start_time) at which each combination was completed
+        self.start_time = time.perf_counter()
+        self.finish_times = []
+        ## time at which the first combination was prepared
+        self.first_prepared_time = None
+        ## --metrics file, and event and thread updating it (see start_metrics)
+        self.f_metrics = None
+        self.metrics_stop = None
+        self.metrics_thread = None
+        ## pool, queue of completed tasks, progress bar and task functions of run_pool, and
+        ## {substitution ID: [result of prepare, number of replicates still running, any failed]}
+        self.pool = None
+        self.events = None
+        self.progress = None
+        self.tasks = {}
+        self.running = {}
+        if not resume or not os.path.exists(f_manifest):
+            with open(f_manifest, "w+") as f:
+                f.write('\t'.join(manifest_columns) + '\n')
+        self.f_dedup = None
+        if f_dedup is not None:
+            self.f_dedup = open(f_dedup, "w+")
+            self.f_dedup.write('\t'.join(dedup_columns) + '\n')
+        return
+    def close(self):
+        if self.f_dedup is not None:
+            self.f_dedup.close()
+        return
+    def append_manifest(self, *row):
+        append_manifest(self.f_manifest, *row)
+        return
+    ## aggregate wall time of each stage of a task (measured in process 'pid' that executed it)
+    def record_timings(self, task, sub_id, replicate, timings, pid):
+        for stage, seconds in timings.items():
+            stats = self.stage_timings.setdefault(stage, [0, 0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+        self.busy_seconds[pid] = self.busy_seconds.get(pid, 0) + sum(timings.values())
+        if self.keep_task_timings:
+            self.task_timings.append({"task": task, "substitution_id": sub_id, "replicate": replicate,
+                                      "pid": pid, "seconds": timings})
+        return
+    def record_started(self):
+        self.num_started += 1
+        return
+    ## record the result (dict) of preparing a combination. If deduplicating, only the first combination
+    ## recorded with a given script is executed: the replicates of later ones are removed from the result
+    ## (so results must be recorded in a fixed order, e.g. that of the substitution IDs)
+    def record_prepared(self, result):
+        if self.first_prepared_time is None:
+            self.first_prepared_time = time.perf_counter()
+        self.record_timings("prepare", result["substitution_id"], None, result["timings"], result["pid"])
+        self.cache_stats[result["pid"]] = result["module_cache"]
+        if result["resumed"]:
+            self.num_resumed += 1
+        if self.f_dedup is not None:
+            result["canonical_id"] = self.canonical_ids.setdefault(result["script_hash"], result["canonical_id"])
+            if result["canonical_id"] != result["substitution_id"] and not result["resumed"]:
+                result["num_replicates"] -= len(result["replicates_todo"])
+                result["replicates_todo"] = []
+            self.f_dedup.write('\t'.join([str(result["substitution_id"]), str(result["canonical_id"]),
+                                          result["script_hash"]]) + '\n')
+            if result["canonical_id"] != result["substitution_id"]:
+                self.num_duplicates += 1
+        return
+    ## record the result (sub_id, i, success, cached, timings, pid) of executing a replicate; returns success
+    def record_replicate(self, value):
+        sub_id, i, success, cached, timings, pid = value
+        self.record_timings("replicate", sub_id, i, timings, pid)
+        self.num_cache_hits += cached
+        self.num_cache_misses += not cached
+        return success
+    ## record that a combination is done (completed, resumed or failed)
+    def record_finished(self, sub_id, failed = False):
+        if failed:
+            self.failed_combos.append(sub_id)
+        self.finish_times.append(time.perf_counter() - self.start_time)
+        return
+    def run_pool(self, p, progress, substitution_ids, prepare, run_replicate, finish, store = None,
+                 chunksize = 1):
+        '''
+        Prepares combinations (prepare(sub_id) -> result dict) with p.imap, then executes all
+        (combination, replicate) pairs as separate tasks (run_replicate(sub_id, script_hash, i, cache_hash))
+        so that all processes are used even if there are fewer combinations than processes, and finishes
+        each combination whose replicates all succeeded (finish(result), then store(result) in the
+        main process if store is not None). Completed tasks are reported to the main thread via a queue
+        (by callbacks in the pool's result thread); progress (tqdm) is updated once per combination.
+        '''
+        import queue
+        self.pool = p
+        self.events = queue.Queue()
+        self.progress = progress
+        self.tasks = {"run_replicate": run_replicate, "finish": finish, "store": store}
+        num_finished = len(self.finish_times)
+        num_combos = 0
+        for result in p.imap(prepare, substitution_ids, chunksize = chunksize):
+            num_combos += 1
+            self.record_started()
+            self.record_prepared(result)
+            self.handle_event(("prepared", result))
+            ## handle replicates that have completed in the meantime
+            while not self.events.empty():
+                self.handle_event(self.events.get())
+        while len(self.finish_times) - num_finished < num_combos:
+            self.handle_event(self.events.get())
+        return
+    def on_error(self, e):
+        self.events.put(("error", e))
+        return
+    def handle_event(self, event):
+        kind, value = event
+        if kind == "error":
+            raise value
+        elif kind == "prepared":
+            ## (also called directly for combinations prepared by imap)
+            if value["resumed"]:
+                self.record_finished(value["substitution_id"])
+                self.progress.update()
+            elif not value["replicates_todo"]:
+                self.pool.apply_async(self.tasks["finish"], (value,),
+                                      callback = lambda r: self.events.put(("finished", r)),
+                                      error_callback = self.on_error)
+            else:
+                self.running[value["substitution_id"]] = [value, len(value["replicates_todo"]), False]
+                for i in value["replicates_todo"]:
+                    self.pool.apply_async(self.tasks["run_replicate"],
+                                          (value["substitution_id"], value["script_hash"], i, value["cache_hash"]),
+                                          callback = lambda r: self.events.put(("replicate", r)),
+                                          error_callback = self.on_error)
+        elif kind == "replicate":
+            sub_id = value[0]
+            success = self.record_replicate(value)
+            self.running[sub_id][1] -= 1
+            self.running[sub_id][2] = self.running[sub_id][2] or not success
+            if self.running[sub_id][1] == 0:
+                result, num_running, failed = self.running.pop(sub_id)
+                if failed:
+                    ## leave outputs of failed combinations as they are (not zipped or marked complete)
+                    self.record_finished(sub_id, failed = True)
+                    self.progress.update()
+                else:
+                    self.handle_event(("prepared", {**result, "replicates_todo": []}))
+        elif kind == "finished":
+            self.record_timings("finish", value["substitution_id"], None, value["finish_timings"], value["pid"])
+            if self.tasks["store"] is not None:
+                self.tasks["store"](value)
+            self.record_finished(value["substitution_id"])
+            self.progress.update()
+        return
+    ## progress and throughput of the run so far
+    def collect_metrics(self, done = False):
+        elapsed = time.perf_counter() - self.start_time
+        num_finished = len(self.finish_times)
+        num_failed = len(self.failed_combos)
+        rate = num_finished / elapsed if elapsed > 0 else 0
+        return {"timestamp": time.time(), "prefix": self.prefix, "done": done,
+                "combinations_total": self.num_combos, "combinations_completed": num_finished - num_failed,
+                "combinations_failed": num_failed, "combinations_running": self.num_started - num_finished,
+                "combinations_pending": self.num_combos - self.num_started,
+                "replicates_executed": self.stage_timings.get("slim", [0])[0],
+                "elapsed_seconds": elapsed, "combinations_per_second": rate,
+                "slim_seconds_per_second": self.stage_timings.get("slim", [0, 0])[1] / elapsed if elapsed > 0 else 0,
+                "eta_seconds": (self.num_combos - num_finished) / rate if rate > 0 else None,
+                "seconds_since_last_completion": elapsed - (self.finish_times[-1] if self.finish_times else 0),
+                ## fraction of the run that each process spent in timed stages of tasks
+                "worker_busy_fraction": {str(pid): seconds / elapsed if elapsed > 0 else 0
+                                         for pid, seconds in dict(self.busy_seconds).items()}}
+    ## write metrics to fname as JSON, or in Prometheus text format if fname ends with .prom
+    ## (via a temporary file, so that readers never see a partially written file)
+    def write_metrics(self, fname, done = False):
+        metrics = self.collect_metrics(done)
+        if fname.endswith(".prom"):
+            lines = []
+            for name, value in metrics.items():
+                if name == "worker_busy_fraction":
+                    lines.extend([f"slimerge_{name}{{prefix=\"{self.prefix}\",pid=\"{pid}\"}} {fraction}"
+                                  for pid, fraction in value.items()])
+                elif name != "prefix" and value is not None:
+                    lines.append(f"slimerge_{name}{{prefix=\"{self.prefix}\"}} {float(value)}")
+            string = '\n'.join(lines) + '\n'
+        else:
+            import json
+            string = json.dumps(metrics) + '\n'
+        with open(f"{fname}.part", "w+") as f:
+            f.write(string)
+        os.replace(f"{fname}.part", fname)
+        return
+    ## update metrics in fname every 'interval' seconds until stop_metrics is called
+    ## (in a background thread, so that metrics are also updated while the main process is executing SLiM
+    ##  or waiting for workers; start after forking worker processes)
+    def start_metrics(self, fname, interval):
+        import threading
+        self.f_metrics = fname
+        self.metrics_stop = threading.Event()
+        self.metrics_thread = threading.Thread(target = self.metrics_loop, args = (interval,), daemon = True)
+        self.write_metrics(fname)
+        self.metrics_thread.start()
+        return
+    def metrics_loop(self, interval):
+        while not self.metrics_stop.wait(interval):
+            self.write_metrics(self.f_metrics)
+        return
+    def stop_metrics(self):
+        if self.metrics_thread is None:
+            return
+        self.metrics_stop.set()
+        self.metrics_thread.join()
+        self.write_metrics(self.f_metrics, done = True)
+        return
+    ## (seconds from 95% to 100% of combinations completed, total seconds), or None if none completed
+    def tail_latency(self):
+        if not self.finish_times:
+            return None
+        t95 = self.finish_times[max(0, -(-len(self.finish_times) * 95 // 100) - 1)]
+        return (self.finish_times[-1] - t95, self.finish_times[-1])
+    ## {stage: {"tasks", "total_seconds", "mean_seconds", "max_seconds"}}
+    def stages(self):
+        return {stage: {"tasks": n, "total_seconds": total, "mean_seconds": total / n, "max_seconds": maximum}
+                for stage, (n, total, maximum) in self.stage_timings.items()}
+    def throughput(self, threads):
+        wall_seconds = time.perf_counter() - self.start_time
+        slim_seconds = self.stage_timings.get("slim", [0, 0, 0])[1]
+        return {"wall_seconds": wall_seconds, "threads": threads, "combinations": len(self.finish_times),
+                "combinations_per_second": len(self.finish_times) / wall_seconds,
+                "replicates_executed": self.stage_timings.get("slim", [0])[0],
+                "slim_seconds": slim_seconds, "slim_seconds_per_second": slim_seconds / wall_seconds}
+    ## print wall time of each stage summed across all processes, and throughput
+    def print_profile(self, threads):
+        stages = self.stages()
+        throughput = self.throughput(threads)
+        total_seconds = sum(stats["total_seconds"] for stats in stages.values())
+        print(f"Profile (wall time summed across {threads} process(es)):")
+        print(f"  {'stage':<20}{'tasks':>9}{'total s':>12}{'mean ms':>12}{'max ms':>12}{'%':>7}")
+        for stage, stats in sorted(stages.items(), key = lambda e: -e[1]["total_seconds"]):
+            print(f"  {stage:<20}{stats['tasks']:>9}{stats['total_seconds']:>12.2f}"
+                  f"{stats['mean_seconds'] * 1000:>12.1f}{stats['max_seconds'] * 1000:>12.1f}"
+                  f"{100 * stats['total_seconds'] / max(total_seconds, 1e-9):>7.1f}")
+        print(f"  {throughput['combinations']} combination(s) in {throughput['wall_seconds']:.1f}s"
+              f" ({throughput['combinations_per_second']:.2f} combinations/s);"
+              f" {throughput['replicates_executed']} SLiM replicate(s), {throughput['slim_seconds']:.1f} SLiM-seconds"
+              f" ({throughput['slim_seconds_per_second']:.2f} SLiM-seconds/s)")
+        return
+    ## write throughput, stages and (if keep_task_timings) the timings of each task to fname as JSON
+    def write_timings_json(self, fname, threads):
+        import json
+        with open(fname, "w+") as f:
+            json.dump({"throughput": self.throughput(threads), "stages": self.stages(),
+                       "tasks": self.task_timings}, f)
+        return
@@ -1,9 +1,10 @@
 import os
 import re
 import copy
+import functools
 import warnings
 
-from code_blocks import Script, ScriptModule
+from code_blocks import Script, ScriptModule, module_cache
 
 # class A:
 #     def __init__(self, a):
@@ -44,6 +45,66 @@ class PathsSearch():
                 self.paths.append(path)
         if update: self.update()
 
+class SubstitutionTemplate():
+    '''
+    String tokenised once into literal segments and candidate '$NAME$' placeholders so that
+    any number of variables can be substituted in a single left-to-right pass.
+    Placeholders are matched leftmost-first; '$NAME$' where NAME is not a variable is left as-is
+    (and its closing '$' may open the next placeholder).
+    '''
+    def __init__(self, string):
+        self.string = string
+        ## every element of self.parts except the first was preceded by '$' in self.string
+        self.parts = string.split('$')
+    def fill(self, variables, recursive = False, _expanding = frozenset()):
+        '''
+        Substitutes values from variables (dict of {name: value}) into template.
+        If recursive = True, placeholders within substituted values are also resolved using
+        variables (a variable is never substituted into its own value).
+        '''
+        parts = self.parts
+        last = len(parts) - 1
+        if last == 0: return self.string
+        output = [parts[0]]
+        i = 1
+        while i <= last:
+            name = parts[i]
+            ## parts[i] is a placeholder only if it is closed by another '$'
+            if i < last and name in variables and name not in _expanding:
+                value = variables[name]
+                if recursive and '$' in value:
+                    value = compile_template(value).fill(variables, recursive = True,
+                                                         _expanding = _expanding | {name})
+                output.append(value)
+                output.append(parts[i+1])
+                i += 2
+            else:
+                output.append('$')
+                output.append(name)
+                i += 1
+        return ''.join(output)
+
+## compiled templates are cached by string as module lines recur in every combination
+@functools.lru_cache(maxsize = 16384)
+def compile_template(string):
+    return SubstitutionTemplate(string)
+
+## substitutes all variables (dict of {name: value}) into string in a single pass
+def substitute_string(string, variables, recursive = False):
+    return compile_template(string).fill(variables, recursive = recursive)
+
+## values of variables (dict of {name: value}) as substituted by replacing one variable after another
+## (in order of definition): placeholders of later variables within a value are resolved, those of earlier
+## variables (and of the variable itself) are left as they are
+def resolve_in_order(variables):
+    if not any('$' in value for value in variables.values()):
+        return variables
+    resolved = {}
+    for name in reversed(list(variables)):
+        value = variables[name]
+        resolved[name] = compile_template(value).fill(resolved) if '$' in value else value
+    return {name: resolved[name] for name in variables}
+
 class SubstitutionParser():
     def __init__(self, comment_function = lambda line: line[:2] == "//"):
         self.description = "Parser for substitution & recipe files"
@@ -127,11 +188,12 @@ class SubstitutionBlockGen():
         return '\n'.join([f"{varname}={value}" for varname, value in self.variables.items()])
     def generate_string(self):
         return self.generate_str_header() + '\n' + self.generate_str_variables() + "\n\n"
-    ## takes a string and substitutes all stored variables into it
-    def substitute(self, string):
-        for varname, val in self.variables.items():
-            string = string.replace(f"${varname}$", val)
-        return string
+    ## takes a string and substitutes all stored variables into it (placeholders in variable values
+    ## are resolved as with one str.replace per variable (see resolve_in_order), or fully if recursive = True)
+    def substitute(self, string, recursive = False):
+        if recursive:
+            return substitute_string(string, self.variables, recursive = True)
+        return substitute_string(string, resolve_in_order(self.variables))
 
 
 ## parse .default file
@@ -349,24 +411,30 @@ class SubstitutionFile():
             module_path = self.get_module_path(module)
             if module_path is None: continue
             ## add module and substitute
-            module_script = ScriptModule(filename = module_path)
+            module_script = module_cache.get(module_path)
             for sub_block in sub_blocks:
                 if sub_block is None: continue
                 new_script.merge_script(module_script.copy(substitute = True,
                                                            substitution_block = sub_block,
                                                            ignore_comments = ignore_comments))
-        ## integrate general block if it exists
+        ## integrate general block if it exists, and
+        ## substitute SUBSTITUTION_ID (defined in self.substitution_file) in the same pass
+        ## (as if substituted after the general block, i.e. also within its values)
+        final_variables = {}
         if general_block is not None:
             for sub_block in general_block:
-                final_script_str = new_script.make_string(substitute = True,
-                                                          substitution_block = sub_block,
-                                                          ignore_comments = ignore_comments)
-        else:
-            final_script_str = new_script.make_string(substitute = False,
-                                                      ignore_comments = ignore_comments)
-        ## substitute SUBSTITUTION_ID (defined in self.substitution_file)
-        final_script_str = final_script_str.replace("$SUBSTITUTION_ID$", str(self.substitution_id))
-        ## output final Script object
+                final_variables = dict(sub_block.variables)
+        final_variables.setdefault("SUBSTITUTION_ID", str(self.substitution_id))
+        final_variables = resolve_in_order(final_variables)
+        substitute_final = lambda line: substitute_string(line, final_variables)
+        ## output final Script object (substituted directly on CodeBlock tree where possible)
+        final_script = new_script.substituted(substitute_final, ignore_comments = ignore_comments)
+        if final_script is not None:
+            output = Script(indentation = indentation, suppress_warning = True)
+            output.code_blocks = final_script.code_blocks
+            return output
+        final_script_str = substitute_final(new_script.make_string(substitute = False,
+                                                                   ignore_comments = ignore_comments))
         return Script(string = final_script_str, indentation = indentation, suppress_warning = True)
 
 
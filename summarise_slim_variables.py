@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 
 import os
+import re
 import shutil
+import zipfile
 import tempfile
 
 dir_slimerge = os.path.dirname(os.path.realpath(__file__))
@@ -13,6 +15,7 @@ import sys
 sys.path.append(dir_slimerge_src)
 
 from substitution_file import SubstitutionFile
+## (output_store (sqlite3) is only imported for databases of --store sqlite)
 
 
 ###############################
@@ -67,9 +70,11 @@ import argparse
 default_variables = []
 default_constants = []
 
-def parse_variables_for_one_substitution(fname, variables = default_variables, constants = default_constants):
+## if string (contents of substitution file) is provided, fname is only used to get the substitution ID
+def parse_variables_for_one_substitution(fname, variables = default_variables, constants = default_constants,
+                                         string = None):
     id_sim, id_substitution = os.path.splitext(os.path.basename(fname))[0].split('_')[-2:]
-    sub_file = SubstitutionFile(fname)
+    sub_file = SubstitutionFile(fname) if string is None else SubstitutionFile(string = string)
     ## get values from substitution file
     try:
         variable_values = get_substitution_values(
@@ -82,37 +87,85 @@ def parse_variables_for_one_substitution(fname, variables = default_variables, c
     variable_values = {"SUBSTITUTION_ID": id_substitution, **variable_values}
     return variable_values
 
+## list of (path of substitution file, source) of every combination in dir_run, sorted by substitution ID,
+## where source is ("zip", <path to zip file>, <member>), ("sqlite", <path to database>, <substitution ID>)
+## or ("file", <path to substitution file>). Only file names are listed; see read_substitution_file
+def list_substitution_files(dir_run, is_zipped = True):
+    output = []
+    for file_folder in os.listdir(dir_run):
+        path = os.path.join(dir_run, file_folder)
+        basename, ext = os.path.splitext(file_folder)
+        if is_zipped and ext == ".zip" and os.path.isfile(path):
+            output.append((os.path.join(path, basename, basename + ".txt"),
+                           ("zip", path, f"{basename}/{basename}.txt")))
+        elif ext == ".sqlite" and os.path.isfile(path):
+            ## skip databases of individual shards if they have been merged (--merge-shards)
+            shard = re.fullmatch(r"(.+)\.shard\d+of\d+", basename)
+            if shard and os.path.exists(os.path.join(dir_run, f"{shard.group(1)}.sqlite")):
+                continue
+            from output_store import OutputStore
+            with OutputStore(path) as output_store:
+                for substitution_id in output_store.substitution_ids():
+                    name = output_store.name(substitution_id)
+                    output.append((os.path.join(path, name, name + ".txt"), ("sqlite", path, substitution_id)))
+        elif not is_zipped and os.path.isdir(path):
+            f_substitution = os.path.join(path, f"{file_folder}.txt")
+            output.append((f_substitution, ("file", f_substitution)))
+    ## (substitution ID is the number after the last '_' in the combination's name)
+    def sort_key(entry):
+        name = os.path.splitext(os.path.basename(entry[0]))[0]
+        id_substitution = name.split('_')[-1]
+        return (0, int(id_substitution), entry[0]) if id_substitution.isdigit() else (1, 0, entry[0])
+    return sorted(output, key = sort_key)
+
+## open databases, indexed by path (one connection per process)
+_output_stores = {}
+
+## contents of substitution file; substitution files in zip files (--zip) and databases (--store sqlite)
+## are read without extracting them
+def read_substitution_file(source):
+    if source[0] == "zip":
+        with zipfile.ZipFile(source[1]) as f_zip:
+            return f_zip.read(source[2]).decode()
+    elif source[0] == "sqlite":
+        if source[1] not in _output_stores:
+            from output_store import OutputStore
+            _output_stores[source[1]] = OutputStore(source[1])
+        return _output_stores[source[1]].substitution_string(source[2])
+    with open(source[1], 'r') as f:
+        return f.read()
+
+## values of summary columns (as a list) of one combination listed by list_substitution_files
+def summarise_one_substitution(entry, colnames, variables = default_variables, constants = default_constants):
+    f_substitution, source = entry
+    variable_values = parse_variables_for_one_substitution(
+        f_substitution, variables = variables, constants = constants,
+        string = read_substitution_file(source))
+    return [variable_values.get(colname, "NA") for colname in colnames]
+
 def summarise_run_gen(dir_run, variables = default_variables, constants = default_constants,
-                      print_progress = lambda i:None, is_zipped = True):
-    ## extract variable values and write to file
+                      print_progress = lambda i:None, is_zipped = True, threads = 1):
+    ## extract variable values and write to file, in order of substitution ID
+    ## (rows are written as they are parsed, in parallel if threads > 1)
     fout = os.path.join(dir_run, "run_summary.txt")
-    with tempfile.TemporaryDirectory() as dir_tmp:
-        colnames = ["SUBSTITUTION_ID"] + variables + constants
-        with open(fout, "w+") as f:
-            f.write('\t'.join(colnames) + '\n')
-            for i, file_folder in enumerate(os.listdir(dir_run)):
+    colnames = ["SUBSTITUTION_ID"] + variables + constants
+    entries = list_substitution_files(dir_run, is_zipped = is_zipped)
+    summarise_one = lambda entry: summarise_one_substitution(entry, colnames,
+                                                             variables = variables, constants = constants)
+    with open(fout, "w+") as f:
+        f.write('\t'.join(colnames) + '\n')
+        def write_rows(rows):
+            for i, row in enumerate(rows):
                 print_progress(i)
-                if is_zipped and os.path.isfile(os.path.join(dir_run, file_folder)):
-                    ## unzip archive
-                    basename, ext = os.path.splitext(file_folder)
-                    # print(basename, ext)
-                    if ext != ".zip":
-                        continue
-                    shutil.unpack_archive(os.path.join(dir_run, file_folder), dir_tmp)
-                    zipped_dir = os.path.join(dir_tmp, basename)
-                    ## filenames
-                    f_substitution = os.path.join(zipped_dir, basename + ".txt")
-                    variable_values = parse_variables_for_one_substitution(
-                        f_substitution, variables = variables, constants = constants)
-                    ## delete tmp directory
-                    shutil.rmtree(zipped_dir)
-                elif not is_zipped and os.path.isdir(os.path.join(dir_run, file_folder)):
-                    f_substitution = os.path.join(dir_run, file_folder, f"{file_folder}.txt")
-                    variable_values = parse_variables_for_one_substitution(
-                        f_substitution, variables = variables, constants = constants)
-                else:
-                    continue
-                f.write('\t'.join([variable_values.get(colname, "NA") for colname in colnames]) + '\n')
+                f.write('\t'.join(row) + '\n')
+            return
+        ## import multiprocess only if threads > 1
+        if threads > 1:
+            import multiprocess as mp
+            with mp.Pool(processes = threads) as p:
+                write_rows(p.imap(summarise_one, entries, chunksize = max(1, min(100, len(entries) // (threads * 4)))))
+        else:
+            write_rows(map(summarise_one, entries))
     return
 
 
@@ -161,6 +214,9 @@ parser.add_argument("-c", "--constants", type=str, help="comma-separated names o
                     dest="constants")
 parser.add_argument("--unzipped", help="raise if run output is not zipped", action="store_false",
                     dest="is_zipped")
+parser.add_argument("-t", "--thread", "--threads", type=int,
+                    help="number of parallel processes used to parse substitution files",
+                    dest="threads", default=1)
 parser.add_argument("--progress-increment", type=int,
                     help=("number of archives to process before printing progress to stdout;"
                           " set to any values <= 0 to skip printing of progress"
@@ -182,7 +238,8 @@ summarise_run_gen(args.dir_run,
                   variables = default_variables if args.variables is None else args.variables.split(','),
                   constants = default_constants if args.constants is None else args.constants.split(','),
                   print_progress = print_progress,
-                  is_zipped = args.is_zipped)
+                  is_zipped = args.is_zipped,
+                  threads = args.threads)
 
 # ## get common output variables
 # dir_output = "/mnt/chaelab/rachelle/scd/results/recipe_run_20230911_sample/scd_1_1"